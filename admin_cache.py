@@ -0,0 +1,80 @@
+import asyncio
+import time
+import traceback
+from metrics import metrics
+
+ADMIN_STATUSES = ("creator", "administrator")
+
+
+# ============================
+# 👮 Кэш администраторов групп
+# ============================
+class AdminCache:
+    """
+    Множество админов по группам, чтобы проверка прав не ходила в Telegram
+    на каждый клик. Список обновляется в фоне раз в ttl секунд и сразу —
+    по апдейтам chat_member / my_chat_member. Статичный ADMINS из конфига
+    добавляется ко всем группам.
+    """
+
+    def __init__(self, bot, static_admins=(), ttl: float = 600.0):
+        self.bot = bot
+        self.static_admins = set(static_admins)
+        self.ttl = ttl
+        self._admins = {}
+        self._loaded_at = {}
+        self._refreshing = {}
+
+    async def refresh(self, chat_id: int):
+        """Загружает список админов группы из Telegram"""
+        try:
+            admins = await self.bot.get_chat_administrators(chat_id)
+        except Exception as e:
+            print(f"⚠️ Не удалось обновить админов {chat_id}: {e}")
+            metrics.inc("admin_cache_errors")
+            return
+        self._admins[chat_id] = {admin.user.id for admin in admins}
+        self._loaded_at[chat_id] = time.monotonic()
+        metrics.inc("admin_cache_refreshes")
+
+    def _refresh_in_background(self, chat_id: int):
+        task = self._refreshing.get(chat_id)
+        if task is None or task.done():
+            self._refreshing[chat_id] = asyncio.create_task(self.refresh(chat_id))
+
+    async def is_admin(self, chat_id: int, user_id: int) -> bool:
+        if user_id in self.static_admins:
+            return True
+        if chat_id not in self._admins:
+            # первый запрос — ждём загрузку (дальше только из памяти)
+            self._refresh_in_background(chat_id)
+            await self._refreshing[chat_id]
+        elif time.monotonic() - self._loaded_at[chat_id] > self.ttl:
+            # устаревший список отвечает сразу, свежий подтянется в фоне
+            self._refresh_in_background(chat_id)
+        return user_id in self._admins.get(chat_id, ())
+
+    def on_member_update(self, event):
+        """chat_member / my_chat_member: правим множество без запроса к Telegram"""
+        chat_id = event.chat.id
+        if chat_id not in self._admins:
+            return
+        user_id = event.new_chat_member.user.id
+        if event.new_chat_member.status in ADMIN_STATUSES:
+            self._admins[chat_id].add(user_id)
+        else:
+            self._admins[chat_id].discard(user_id)
+            if user_id == self.bot.id:
+                # бота разжаловали — chat_member больше не придут, держим только TTL
+                self._loaded_at[chat_id] = 0.0
+        metrics.inc("admin_cache_member_updates")
+
+    async def run(self, chat_ids, interval: float | None = None):
+        """Фоновое обновление списков админов"""
+        while True:
+            for chat_id in chat_ids:
+                try:
+                    await self.refresh(chat_id)
+                except Exception:
+                    traceback.print_exc()
+            await asyncio.sleep(interval or self.ttl)
@@ -0,0 +1,409 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from google_sheets import HEADERS
+from metrics import metrics
+
+# форматы, в которых встречается "Дата" в таблице
+DATE_FORMATS = ("%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def _q(name: str) -> str:
+    """Экранирует имя колонки (заголовки на кириллице и с пробелами)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+# seq считается в самом запросе — атомарно, даже если в базу пишут несколько воркеров
+NEXT_SEQ = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM complaints)"
+
+
+def parse_date(raw) -> datetime | None:
+    """Разбирает дату жалобы в одном из известных форматов"""
+    raw = str(raw or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _date_key(raw) -> str | None:
+    """Сортируемое представление даты для индекса (YYYY-MM-DD HH:MM:SS)"""
+    parsed = parse_date(raw)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S") if parsed else None
+
+
+COLUMNS = ", ".join(_q(h) for h in HEADERS)
+
+# колонки с датами и с повторяющимися значениями (категории)
+DATETIME_COLUMNS = ["Дата", "Время обзвона", "Время решения", "Время уведомления"]
+CATEGORY_COLUMNS = ["Филиал", "Категория", "Статус"]
+
+
+def iter_rows(path: str, start_date: str | None = None, end_date: str | None = None,
+              batch_size: int = 2000):
+    """
+    Построчно читает жалобы из базы (для выгрузок в отдельном процессе):
+    своё соединение, в памяти — не больше batch_size строк.
+    С датами — только диапазон по date_ts, по порядку дат
+    (end_date включается целиком, как в отчётах по дням).
+    """
+    conn = sqlite3.connect(path)
+    try:
+        if start_date is None:
+            cur = conn.execute(f"SELECT {COLUMNS} FROM complaints ORDER BY rowid")
+        else:
+            start = pd.to_datetime(start_date).strftime("%Y-%m-%d %H:%M:%S")
+            end = (pd.to_datetime(end_date).normalize() + pd.Timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+            cur = conn.execute(
+                f"SELECT {COLUMNS} FROM complaints "
+                f"WHERE date_ts >= ? AND date_ts < ? ORDER BY date_ts",
+                (start, end),
+            )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """Векторно разбирает колонку дат: сначала основной формат, затем остальные"""
+    values = values.astype(str).str.strip()
+    parsed = pd.to_datetime(values, format=DATE_FORMATS[0], errors="coerce")
+    for fmt in DATE_FORMATS[1:]:
+        missing = parsed.isna() & values.ne("")
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(values[missing], format=fmt, errors="coerce")
+    return parsed
+
+
+def to_typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Даты → datetime64, Филиал/Категория/Статус → category (разбор один раз)"""
+    for col in DATETIME_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _align_categories(left: pd.DataFrame, right: pd.DataFrame):
+    """Общий набор категорий, чтобы строки можно было переносить между таблицами"""
+    for col in CATEGORY_COLUMNS:
+        categories = left[col].cat.categories.union(right[col].cat.categories)
+        left[col] = left[col].cat.set_categories(categories)
+        right[col] = right[col].cat.set_categories(categories)
+
+
+class ComplaintStore:
+    """
+    Локальная база жалоб (SQLite, WAL) — основной источник данных.
+    Google Sheets обновляется из неё в фоне (см. replicator.py).
+
+    Служебные колонки:
+      date_ts  — "Дата" в сортируемом виде (для диапазонов дат)
+      rev      — номер версии строки, растёт при каждом изменении
+      dirty    — 1, если изменения ещё не отправлены в Google Sheets
+      in_sheet — 1, если строка уже есть в Google Sheets
+      seq      — глобальный номер последнего изменения (для дельта-синхронизации)
+    """
+
+    def __init__(self, path: str, full_resync_interval: float = 3600.0):
+        self.path = path
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+        # DataFrame в памяти, дополняемый только изменёнными строками
+        self.full_resync_interval = full_resync_interval
+        self._frame = None
+        self._frame_seq = 0
+        self._frame_loaded_at = 0.0
+
+    def _create_schema(self):
+        fields = ",\n".join(
+            f"{_q(h)} TEXT NOT NULL DEFAULT ''" for h in HEADERS if h != "ID"
+        )
+        with self._lock:
+            self._conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS complaints (
+                    "ID" TEXT PRIMARY KEY,
+                    {fields},
+                    date_ts TEXT,
+                    rev INTEGER NOT NULL DEFAULT 0,
+                    dirty INTEGER NOT NULL DEFAULT 1,
+                    in_sheet INTEGER NOT NULL DEFAULT 0,
+                    seq INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            # базы, созданные до появления колонки seq
+            existing = {r[1] for r in self._conn.execute("PRAGMA table_info(complaints)")}
+            if "seq" not in existing:
+                self._conn.execute("ALTER TABLE complaints ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+
+            self._conn.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_complaints_date ON complaints(date_ts);
+                CREATE INDEX IF NOT EXISTS idx_complaints_branch ON complaints("Филиал");
+                CREATE INDEX IF NOT EXISTS idx_complaints_status ON complaints("Статус");
+                CREATE INDEX IF NOT EXISTS idx_complaints_category ON complaints("Категория");
+                CREATE INDEX IF NOT EXISTS idx_complaints_dirty ON complaints(dirty) WHERE dirty = 1;
+                CREATE INDEX IF NOT EXISTS idx_complaints_seq ON complaints(seq);
+            """)
+
+    # ======================================================
+    # 🔔 Подписка на изменения
+    # ======================================================
+    def subscribe(self, callback):
+        """
+        callback(before, after) — вызывается после каждого изменения жалобы.
+        before=None — новая жалоба; before=None и after=None — данные
+        загружены целиком (импорт из Google Sheets), кэши нужно пересобрать.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, before: dict | None, after: dict | None):
+        for callback in self._listeners:
+            try:
+                callback(before, after)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика изменений жалобы: {e}")
+
+    def last_seq(self) -> int:
+        """Номер последнего изменения в базе (с учётом других воркеров)"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM complaints").fetchone()[0]
+
+    # ======================================================
+    # ⚙️ Служебные значения
+    # ======================================================
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta(key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    def is_imported(self) -> bool:
+        """Загружены ли уже жалобы из Google Sheets"""
+        return self.get_meta("sheet_imported") == "1"
+
+    def import_rows(self, values: list):
+        """
+        Первичная загрузка из Google Sheets (результат get_all_values()).
+        Строки помечаются как уже находящиеся в таблице.
+        При повторяющихся ID остаётся первая строка — как в старом поиске по ID.
+        """
+        if values:
+            headers = values[0]
+            rows = []
+            for raw in values[1:]:
+                record = {h: (raw[i] if i < len(raw) else "") for i, h in enumerate(headers)}
+                if not str(record.get("ID", "")).strip():
+                    continue
+                record["ID"] = str(record["ID"]).strip()
+                rows.append([record.get(h, "") for h in HEADERS] + [_date_key(record.get("Дата"))])
+
+            placeholders = ", ".join("?" for _ in range(len(HEADERS) + 1))
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(
+                        f"INSERT OR IGNORE INTO complaints ({COLUMNS}, date_ts, dirty, in_sheet, seq) "
+                        f"VALUES ({placeholders}, 0, 1, {NEXT_SEQ})",
+                        rows
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            print(f"📥 Загружено жалоб из Google Sheets: {len(rows)}")
+        self.set_meta("sheet_imported", 1)
+        self._notify(None, None)
+
+    def known_ids(self) -> list:
+        """Все ID жалоб (для инициализации счётчика ID)"""
+        if not self.is_imported():
+            raise RuntimeError("Локальная база ещё не загружена из Google Sheets")
+        with self._lock:
+            return [r[0] for r in self._conn.execute('SELECT "ID" FROM complaints')]
+
+    # ======================================================
+    # ✅ Добавление жалобы
+    # ======================================================
+    def add_complaint(self, complaint: dict):
+        """Сохраняет новую жалобу (повторное сохранение того же ID — перезапись)"""
+        record = {h: str(complaint.get(h, "") or "") for h in HEADERS}
+        record["ID"] = record["ID"].strip()
+        updates = ", ".join(f"{_q(h)} = excluded.{_q(h)}" for h in HEADERS if h != "ID")
+        placeholders = ", ".join("?" for _ in range(len(HEADERS) + 1))
+        try:
+            with self._lock:
+                before = self._fetch(record["ID"])
+                self._conn.execute(
+                    f"INSERT INTO complaints ({COLUMNS}, date_ts, seq) VALUES ({placeholders}, {NEXT_SEQ}) "
+                    f"ON CONFLICT(\"ID\") DO UPDATE SET {updates}, date_ts = excluded.date_ts, "
+                    f"rev = rev + 1, dirty = 1, seq = excluded.seq",
+                    [record[h] for h in HEADERS] + [_date_key(record["Дата"])]
+                )
+            print(f"✅ Добавлена жалоба ID: {record['ID']}")
+        except Exception as e:
+            print(f"❌ Ошибка при добавлении жалобы: {e}")
+            return False
+
+        self._notify(before, record)
+        return True
+
+    # ======================================================
+    # ✅ Поиск по ID
+    # ======================================================
+    def _fetch(self, complaint_id: str) -> dict | None:
+        row = self._conn.execute(
+            f'SELECT {COLUMNS} FROM complaints WHERE "ID" = ?',
+            (str(complaint_id).strip(),)
+        ).fetchone()
+        return dict(zip(HEADERS, row)) if row else None
+
+    # ======================================================
+    # ✅ Обновление по ID
+    # ======================================================
+    def update_by_id(self, complaint_id: str, updates: dict):
+        """Обновляет значения по ID; возвращает обновлённую запись или {}"""
+        fields = {h: str(v if v is not None else "") for h, v in updates.items() if h in HEADERS and h != "ID"}
+        with self._lock:
+            before = self._fetch(complaint_id)
+            if before is None:
+                print(f"⚠️ Жалоба с ID {complaint_id} не найдена.")
+                return {}
+            if fields:
+                assignments = ", ".join(f"{_q(h)} = ?" for h in fields)
+                params = list(fields.values())
+                if "Дата" in fields:
+                    assignments += ", date_ts = ?"
+                    params.append(_date_key(fields["Дата"]))
+                self._conn.execute(
+                    f'UPDATE complaints SET {assignments}, rev = rev + 1, dirty = 1, seq = {NEXT_SEQ} WHERE "ID" = ?',
+                    params + [before["ID"]]
+                )
+        after = {**before, **fields}
+        self._notify(before, after)
+        return after
+
+    # ======================================================
+    # ✅ Получение всех данных (для отчётов)
+    # ======================================================
+    def get_all_data(self):
+        """
+        Возвращает все жалобы в виде типизированного DataFrame (колонки как в таблице):
+        даты уже разобраны в datetime64, Филиал/Категория/Статус — category.
+
+        Это общий объект для всех потребителей — его нельзя изменять
+        (фильтрация и groupby создают новые таблицы и безопасны). Сам store
+        его тоже не меняет: изменения собираются в новой таблице, так что
+        выданная раньше (и StatsCube.df в кэше) остаётся целым снимком.
+
+        Новая таблица строится из прошлой и строк, изменённых с прошлого
+        раза (seq); полная перезагрузка — раз в full_resync_interval секунд
+        или при расхождении числа строк.
+        """
+        with self._lock:
+            self._sync_frame()
+            frame = self._frame
+        if frame.empty:
+            return pd.DataFrame()
+        return frame
+
+    def _load_frame(self, where: str = "", params=()):
+        rows = self._conn.execute(
+            f"SELECT {COLUMNS} FROM complaints {where} ORDER BY rowid", params
+        ).fetchall()
+        frame = pd.DataFrame(rows, columns=HEADERS)
+        frame.index = pd.Index(frame["ID"].tolist())
+        return to_typed_frame(frame)
+
+    def _sync_frame(self):
+        seq = self.last_seq()
+        stale = time.monotonic() - self._frame_loaded_at > self.full_resync_interval
+        if self._frame is None or stale or list(self._frame.columns) != HEADERS:
+            self._full_sync(seq)
+            return
+        if self._frame_seq == seq:
+            return
+
+        delta = self._load_frame("WHERE seq > ?", (self._frame_seq,))
+        # копия: уже выданную таблицу не трогаем
+        frame = self._frame.copy()
+        _align_categories(frame, delta)
+        known = delta.index.isin(frame.index)
+        if known.any():
+            changed = delta[known]
+            for col in HEADERS[1:]:
+                frame.loc[changed.index, col] = changed[col]
+        if (~known).any():
+            frame = pd.concat([frame, delta[~known]])
+        self._frame = frame
+        self._frame_seq = seq
+        metrics.inc("store_delta_rows", len(delta))
+
+        count = self._conn.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
+        if count != len(self._frame):
+            self._full_sync(seq)
+
+    def _full_sync(self, seq: int):
+        self._frame = self._load_frame()
+        self._frame_seq = seq
+        self._frame_loaded_at = time.monotonic()
+        metrics.inc("store_full_syncs")
+
+    # ======================================================
+    # 🔁 Репликация в Google Sheets
+    # ======================================================
+    def pending_replication(self, limit: int = 100) -> list:
+        """Жалобы, изменения которых ещё не отправлены в Google Sheets"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS}, rev, in_sheet FROM complaints "
+                f"WHERE dirty = 1 ORDER BY rowid LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {"record": dict(zip(HEADERS, r[:len(HEADERS)])), "rev": r[-2], "in_sheet": bool(r[-1])}
+            for r in rows
+        ]
+
+    def pending_count(self) -> int:
+        """Глубина очереди репликации"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM complaints WHERE dirty = 1").fetchone()[0]
+
+    def mark_replicated(self, complaint_id: str, rev: int):
+        """Строка записана в таблицу; снимаем dirty, если её не меняли после чтения"""
+        with self._lock:
+            self._conn.execute('UPDATE complaints SET in_sheet = 1 WHERE "ID" = ?', (complaint_id,))
+            self._conn.execute(
+                'UPDATE complaints SET dirty = 0 WHERE "ID" = ? AND rev = ?', (complaint_id, rev)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,112 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from openpyxl import Workbook
+from complaint_store import DATETIME_COLUMNS, iter_rows, parse_date
+from google_sheets import HEADERS
+from metrics import metrics
+
+# номера колонок с датами — пишем их настоящими датами Excel
+_DATE_INDEXES = [HEADERS.index(col) for col in DATETIME_COLUMNS if col in HEADERS]
+
+
+def build_workbook(path: str, start_date: str | None = None, end_date: str | None = None,
+                   summary: list | None = None) -> tuple[bytes, int]:
+    """
+    Собирает xlsx в режиме write-only: строки идут из базы потоком и сразу
+    пишутся в лист, таблица целиком в памяти не держится.
+    summary — строки листа «Сводка» (первая — заголовки).
+    Возвращает (содержимое файла, число строк жалоб).
+    Выполняется в отдельном процессе: python excel_export.py (см. ExcelExporter).
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Данные")
+    ws.append(HEADERS)
+    count = 0
+    for row in iter_rows(path, start_date, end_date):
+        # пустые ячейки не пишем вовсе (None) — большая часть времени уходит на XML
+        row = [value if value != "" else None for value in row]
+        for i in _DATE_INDEXES:
+            if row[i] is not None:
+                row[i] = parse_date(row[i]) or row[i]
+        ws.append(row)
+        count += 1
+
+    if summary:
+        sheet = wb.create_sheet("Сводка")
+        for row in summary:
+            sheet.append(row)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue(), count
+
+
+# ============================
+# 📥 Выгрузка Excel вне event loop
+# ============================
+class ExcelExporter:
+    """
+    Выгрузки в отдельном процессе: сборка большого файла не останавливает
+    бота для остальных пользователей. Процесс — новый интерпретатор
+    (python excel_export.py): fork скопировал бы потоки и их блокировки
+    (пул Google Sheets, SQLite, event loop), а spawn/forkserver из
+    multiprocessing заново выполнили бы main.py (создание бота) в дочернем
+    процессе. Туда уходят только простые данные (путь к базе, даты,
+    сводка — JSON в stdin), обратно — байты файла (stdout). На диск
+    ничего не пишется.
+    """
+
+    def __init__(self, path: str, workers: int = 1):
+        self.path = os.path.abspath(path)
+        # одновременных выгрузок (процессов)
+        self._slots = asyncio.Semaphore(workers)
+        self._running = set()
+
+    async def export(self, start_date: str | None = None, end_date: str | None = None,
+                     summary: list | None = None) -> bytes:
+        """Все жалобы (или диапазон дат) + необязательная сводка → xlsx"""
+        request = json.dumps(
+            {"path": self.path, "start_date": start_date, "end_date": end_date, "summary": summary},
+            ensure_ascii=False,
+            # numpy-числа из сводки → обычные
+            default=lambda value: value.item() if hasattr(value, "item") else str(value),
+        ).encode()
+        started = time.monotonic()
+        async with self._slots:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            self._running.add(proc)
+            try:
+                data, err = await proc.communicate(request)
+            finally:
+                self._running.discard(proc)
+        err = err.decode(errors="replace")
+        if proc.returncode != 0:
+            raise RuntimeError(f"Выгрузка Excel не удалась: {err.strip()[-500:]}")
+        metrics.observe("excel_export_seconds", time.monotonic() - started)
+        metrics.inc("excel_export_rows", int(err.rsplit("rows:", 1)[-1]))
+        return data
+
+    def close(self):
+        for proc in list(self._running):
+            if proc.returncode is None:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    # дочерний процесс ExcelExporter: запрос — JSON в stdin, файл — в stdout
+    request = json.load(sys.stdin)
+    data, count = build_workbook(
+        request["path"], request.get("start_date"), request.get("end_date"), request.get("summary")
+    )
+    sys.stdout.buffer.write(data)
+    sys.stdout.flush()
+    print(f"rows:{count}", file=sys.stderr)
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from metrics import metrics
+
+
+# ============================
+# 📝 FSM-хранилище анкеты в SQLite
+# ============================
+class SQLiteStorage(BaseStorage):
+    """
+    Хранит состояние и данные анкеты (ComplaintForm) в SQLite, чтобы
+    незаконченная жалоба переживала перезапуск.
+
+    Чтение — из памяти, запись — отложенная: все update_data одного шага
+    анкеты уходят в базу одной транзакцией через flush_delay секунд.
+    Анкеты, которые не трогали дольше ttl, удаляются.
+    shared=True — несколько воркеров: чтение всегда из базы, запись сразу
+    (склейку записей одного апдейта даёт BufferedFSMContext).
+
+    fsm:
+      key     — bot:chat:user:thread:business:destiny
+      state   — текущее состояние ("ComplaintForm:phone") или NULL
+      data    — данные анкеты (JSON)
+      updated — unix time последнего изменения
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 86400, flush_delay: float = 0.5,
+                 purge_interval: float = 3600.0, shared: bool = False):
+        self.ttl = ttl
+        self.shared = shared
+        self.flush_delay = flush_delay
+        self.purge_interval = purge_interval
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated REAL NOT NULL
+            )
+        """)
+        self._cache = {}
+        self._dirty = set()
+        self._flush_task = None
+        self._purged_at = 0.0
+        self.purge()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            key.business_connection_id, key.destiny,
+        ))
+
+    def _record(self, key: StorageKey) -> dict:
+        k = self._key(key)
+        record = self._cache.get(k)
+        if record is None or (self.shared and k not in self._dirty):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT state, data, updated FROM fsm WHERE key = ?", (k,)
+                ).fetchone()
+            if row:
+                record = {"state": row[0], "data": json.loads(row[1]), "updated": row[2]}
+            else:
+                record = {"state": None, "data": {}, "updated": time.time()}
+            self._cache[k] = record
+        if record["updated"] < time.time() - self.ttl:
+            # брошенная анкета
+            record.update(state=None, data={})
+        return record
+
+    def _touch(self, key: StorageKey, record: dict):
+        record["updated"] = time.time()
+        self._dirty.add(self._key(key))
+        if self.shared:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self.flush()
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for k in dirty:
+            record = self._cache.get(k)
+            if record is None:
+                continue
+            if record["state"] is None and not record["data"]:
+                deletes.append((k,))
+                # пустую анкету не держим и в памяти
+                self._cache.pop(k, None)
+            else:
+                upserts.append((k, record["state"], json.dumps(record["data"], ensure_ascii=False), record["updated"]))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?)", upserts
+            )
+            self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self._conn.execute("COMMIT")
+        metrics.inc("fsm_flushes")
+        metrics.inc("fsm_rows_written", len(upserts) + len(deletes))
+        if time.time() - self._purged_at > self.purge_interval:
+            self.purge()
+
+    def purge(self):
+        """Удаляет анкеты, которые не трогали дольше ttl"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM fsm WHERE updated < ?", (cutoff,)).rowcount
+        for k in [k for k, r in self._cache.items() if r["updated"] < cutoff and k not in self._dirty]:
+            del self._cache[k]
+        self._purged_at = time.time()
+        if removed:
+            metrics.inc("fsm_expired", removed)
+        metrics.set("fsm_cached", len(self._cache))
+
+    # ------------------------------
+    # BaseStorage
+    # ------------------------------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record["state"] = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._record(key)
+        record["data"] = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._record(key)["data"])
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        record = self._record(key)
+        record["data"].update(data)
+        self._touch(key, record)
+        return dict(record["data"])
+
+    async def close(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+# ============================
+# 📦 Буферизованный FSMContext
+# ============================
+class BufferedFSMContext(FSMContext):
+    """
+    FSMContext одного апдейта: состояние и данные читаются из хранилища
+    один раз, изменения копятся в памяти и записываются в flush() —
+    одним set_state и одним update_data (или set_data после clear/set_data).
+    """
+
+    def __init__(self, context: FSMContext):
+        super().__init__(storage=context.storage, key=context.key)
+        self._state = None
+        self._state_known = False
+        self._state_dirty = False
+        self._data = None
+        self._changed = set()
+        self._replaced = False
+
+    async def _load_data(self) -> dict:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_known = True
+        self._state_dirty = True
+
+    async def get_state(self) -> Optional[str]:
+        if not self._state_known:
+            self._state = await self.storage.get_state(key=self.key)
+            self._state_known = True
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = dict(data)
+        self._replaced = True
+        self._changed.clear()
+
+    async def get_data(self) -> Dict[str, Any]:
+        return dict(await self._load_data())
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current = await self._load_data()
+        current.update(kwargs)
+        self._changed.update(kwargs)
+        return dict(current)
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения в хранилище"""
+        if self._state_dirty:
+            await self.storage.set_state(key=self.key, state=self._state)
+            self._state_dirty = False
+        if self._replaced:
+            await self.storage.set_data(key=self.key, data=self._data)
+        elif self._changed:
+            # только изменённые ключи — не затираем параллельные апдейты
+            await self.storage.update_data(
+                key=self.key, data={k: self._data[k] for k in self._changed}
+            )
+        self._replaced = False
+        self._changed.clear()
+
+
+class BufferedFSMMiddleware(BaseMiddleware):
+    """Подменяет state в хендлере на BufferedFSMContext и сбрасывает его после хендлера"""
+
+    async def __call__(self, handler, event, data):
+        state = data.get("state")
+        if not isinstance(state, FSMContext) or isinstance(state, BufferedFSMContext):
+            return await handler(event, data)
+
+        buffered = BufferedFSMContext(state)
+        data["state"] = buffered
+        try:
+            return await handler(event, data)
+        finally:
+            await buffered.flush()
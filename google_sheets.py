@@ -1,135 +1,258 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import gspread
-import pandas as pd
+from google.auth.exceptions import TransportError
 from google.oauth2.service_account import Credentials
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from requests.exceptions import RequestException
 from datetime import datetime
+
+HEADERS = [
+    "ID", "Дата", "Филиал", "Родитель", "Ученик", "Телефон", "Категория", "Жалоба",
+    "Статус", "Время обзвона", "Решение", "Ответственный",
+    "Время решения", "Время уведомления", "Кто уведомил родителя",
+    "Отправитель", "User ID"
+]
+
+
+def error_status(e: Exception) -> int | None:
+    """HTTP-статус ошибки Google API (если есть)"""
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return error_status(e) == 429
+
+
+def is_retryable(e: Exception) -> bool:
+    """Временная ошибка: квота (429), ошибка сервера (5xx) или сеть"""
+    status = error_status(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(e, (RequestException, TransportError))
+
+
 class GoogleSheetsClient:
     def __init__(self, service_file: str, sheet_id: str):
-        """Подключение к Google Sheets"""
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        creds = Credentials.from_service_account_file(service_file, scopes=scopes)
-        self.client = gspread.authorize(creds)
-        self.sheet = self.client.open_by_key(sheet_id).worksheet("Complaints")
+        """Клиент Google Sheets. Подключается один раз при первом обращении"""
+        self.service_file = service_file
+        self.sheet_id = sheet_id
+        self.client = None
+        self._sheet = None
+        self._lock = threading.RLock()
+        # индекс "ID жалобы → номер строки" (строится один раз, дополняется при добавлении)
+        self._row_index = {}
+        # заголовок → номер колонки (кэшируется при подключении)
+        self._columns = {}
+
+    # ======================================================
+    # 🔌 Подключение и переподключение
+    # ======================================================
+    def connect(self):
+        """Авторизация, открытие листа и проверка заголовков (один раз на процесс)"""
+        with self._lock:
+            scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+            creds = Credentials.from_service_account_file(self.service_file, scopes=scopes)
+            # gspread сам обновляет access token через AuthorizedSession
+            self.client = gspread.authorize(creds)
+            self._sheet = self.client.open_by_key(self.sheet_id).worksheet("Complaints")
 
-        # ✅ Проверяем заголовки при запуске
-        self.ensure_headers()
+            # ✅ Проверяем заголовки при подключении
+            self.ensure_headers()
+            self._rebuild_index(self._sheet)
+            print("🔌 Подключение к Google Sheets установлено.")
+        return self
+
+    @property
+    def sheet(self):
+        with self._lock:
+            if self._sheet is None:
+                self.connect()
+            return self._sheet
+
+    def _call(self, func, retry: bool = True):
+        """
+        Выполняет запрос к листу; при сетевой/API ошибке переподключается и
+        повторяет один раз. Записи (retry=False) не повторяются: Google мог
+        уже применить запрос до ошибки (таймаут, 5xx), а повтор добавил бы
+        строку второй раз — повторы записей делает SheetsReplicator.
+        """
+        try:
+            return func(self.sheet)
+        except (APIError, RequestException, TransportError) as e:
+            if is_rate_limited(e):
+                # при превышении квоты переподключение не поможет — решает вызывающий код
+                raise
+            print(f"⚠️ Ошибка Google Sheets ({e}) — переподключаюсь.")
+            with self._lock:
+                self._sheet = None
+            if not retry:
+                raise
+            return func(self.sheet)
+
+    # ======================================================
+    # 🗂 Индекс ID → строка
+    # ======================================================
+    def _rebuild_index(self, ws):
+        """Перестраивает индекс по первому столбцу (одно чтение колонки A)"""
+        ids = ws.col_values(1)
+        with self._lock:
+            self._row_index = {
+                str(v).strip(): i
+                for i, v in enumerate(ids[1:], start=2)
+                if str(v).strip()
+            }
+
+    def _remember_rows(self, complaint_ids: list, response):
+        """Запоминает номера строк из ответа append_row(s) (updatedRange вида 'Complaints!A12:Q14')"""
+        try:
+            updated_range = response["updates"]["updatedRange"]
+            first_cell = updated_range.split("!")[-1].split(":")[0]
+            first_row, _ = a1_to_rowcol(first_cell)
+            with self._lock:
+                for offset, complaint_id in enumerate(complaint_ids):
+                    self._row_index[str(complaint_id).strip()] = first_row + offset
+        except Exception:
+            # номера строк неизвестны — индекс догрузится при следующем промахе
+            pass
 
     # ======================================================
     # ✅ Проверка и выравнивание заголовков
     # ======================================================
     def ensure_headers(self):
         """Проверяет, что заголовки совпадают с нужными, иначе исправляет"""
-        expected_headers = [
-            "ID", "Дата", "Филиал", "Родитель", "Ученик", "Телефон", "Категория", "Жалоба",
-            "Статус", "Время обзвона", "Решение", "Ответственный",
-            "Время решения", "Время уведомления", "Кто уведомил родителя",
-            "Отправитель", "User ID"
-        ]
+        expected_headers = HEADERS
 
-        current_headers = self.sheet.row_values(1)
+        current_headers = self._sheet.row_values(1)
         if current_headers[:len(expected_headers)] != expected_headers:
             print("⚠️ Заголовки не совпадают с ожидаемыми — обновляю строку 1.")
-            self.sheet.delete_rows(1)
-            self.sheet.insert_row(expected_headers, 1)
+            self._sheet.delete_rows(1)
+            self._sheet.insert_row(expected_headers, 1)
             print("✅ Заголовки синхронизированы.")
+            current_headers = expected_headers
 
-    # ======================================================
-    # ✅ Добавление жалобы (строго по колонкам)
-    # ======================================================
-    def add_complaint(self, complaint: dict):
-        """Добавляет новую жалобу строго в нужные колонки"""
-        headers = [
-            "ID", "Дата", "Филиал", "Родитель", "Ученик", "Телефон", "Категория", "Жалоба",
-            "Статус", "Время обзвона", "Решение", "Ответственный",
-            "Время решения", "Время уведомления", "Кто уведомил родителя",
-            "Отправитель", "User ID"
-        ]
-
-        try:
-            row = [complaint.get(h, "") for h in headers]
-            self.sheet.append_row(row, value_input_option="USER_ENTERED")
-            print(f"✅ Добавлена жалоба ID: {complaint.get('ID', '?')}")
-            return True
-        except Exception as e:
-            print(f"❌ Ошибка при добавлении жалобы: {e}")
-            return False
+        self._columns = {h: i for i, h in enumerate(current_headers, start=1) if h}
 
-    # ======================================================
-    # ✅ Поиск по ID
-    # ======================================================
-    def get_row_by_id(self, complaint_id: str):
-        """Возвращает (индекс строки, словарь данных) по ID"""
-        try:
-            all_values = self.sheet.get_all_values()
-            if not all_values:
-                return None, {}
-
-            headers = all_values[0]
-            for i, row in enumerate(all_values[1:], start=2):
-                if not row or not row[0]:
-                    continue
-                if str(row[0]).strip() == str(complaint_id).strip():
-                    data = {headers[j]: (row[j] if j < len(row) else "") for j in range(len(headers))}
-                    return i, data
-            return None, {}
-        except Exception as e:
-            print(f"⚠️ Ошибка при поиске ID {complaint_id}: {e}")
-            return None, {}
+    def add_complaints(self, complaints: list):
+        """
+        Добавляет несколько жалоб одним append_rows.
+        Ошибки не глушатся — вызывающий код сам решает, когда повторить.
+        """
+        rows = [[c.get(h, "") for h in HEADERS] for c in complaints]
+        response = self._call(lambda ws: ws.append_rows(rows, value_input_option="USER_ENTERED"), retry=False)
+        ids = [str(c.get("ID", "")).strip() for c in complaints]
+        self._remember_rows(ids, response)
+        print(f"✅ Добавлено жалоб: {len(rows)}")
 
     # ======================================================
     # ✅ Обновление по ID
     # ======================================================
-    def update_by_id(self, complaint_id: str, updates: dict):
-        """Обновляет значения по ID (все ключи должны совпадать с заголовками)"""
-        try:
-            row_index, _ = self.get_row_by_id(complaint_id)
-            if not row_index:
-                print(f"⚠️ Жалоба с ID {complaint_id} не найдена.")
-                return False
-
-            headers = self.sheet.row_values(1)
-            if not headers:
-                print("⚠️ Нет заголовков в таблице.")
-                return False
-
-            # собираем диапазон обновления
-            cell_list = self.sheet.range(row_index, 1, row_index, len(headers))
-            for cell in cell_list:
-                header = headers[cell.col - 1]
-                if header in updates:
-                    cell.value = updates[header]
-
-            self.sheet.update_cells(cell_list, value_input_option="USER_ENTERED")
-            print(f"✅ Жалоба {complaint_id} успешно обновлена.")
-            return True
-
-        except Exception as e:
-            print(f"❌ Ошибка при обновлении жалобы {complaint_id}: {e}")
-            return False
+    def _resolve_rows(self, complaint_ids):
+        """ID → номер строки; при промахе индекс перестраивается один раз"""
+        ids = [str(cid).strip() for cid in complaint_ids]
+        with self._lock:
+            missing = [cid for cid in ids if cid not in self._row_index]
+        if missing:
+            self._call(self._rebuild_index)
+        with self._lock:
+            return {cid: self._row_index[cid] for cid in ids if cid in self._row_index}
+
+    def _verify_rows(self, rows: dict) -> dict:
+        """
+        Проверяет, что в колонке A найденных строк всё ещё стоят эти ID
+        (одно batch_get на пачку): строки могли отсортировать, удалить или
+        вставить вручную. При расхождении индекс перестраивается и проверка
+        повторяется; ID, которых так и нет на месте, из ответа убираются.
+        """
+        for attempt in range(2):
+            if not rows:
+                return rows
+            items = list(rows.items())
+            values = self._call(lambda ws: ws.batch_get([f"A{row}" for _, row in items]))
+            stale = [
+                cid for (cid, _), value in zip(items, values)
+                if not (value and value[0] and str(value[0][0]).strip() == cid)
+            ]
+            if not stale:
+                return rows
+            if attempt == 0:
+                print(f"⚠️ Строки в Google Sheets сдвинулись ({len(stale)} ID) — перестраиваю индекс.")
+                self._call(self._rebuild_index)
+                with self._lock:
+                    rows = {cid: self._row_index[cid] for cid in rows if cid in self._row_index}
+        return {cid: row for cid, row in rows.items() if cid not in stale}
+
+    def _cells(self, row_index: int, updates: dict):
+        """Изменённые ячейки строки в формате batch_update (адреса A1)"""
+        return [
+            {"range": rowcol_to_a1(row_index, self._columns[h]), "values": [[value]]}
+            for h, value in updates.items()
+            if h in self._columns
+        ]
+
+    def update_many(self, updates_by_id: dict):
+        """
+        Обновляет несколько жалоб одним batch_update: {ID: {заголовок: значение}}.
+        Возвращает список ID, которых нет в таблице. Ошибки API пробрасываются.
+        Номера строк сверяются с колонкой A перед записью (_verify_rows):
+        устаревший индекс иначе перезаписал бы целиком чужую строку.
+        """
+        rows = self._verify_rows(self._resolve_rows(updates_by_id))
+        data = []
+        for cid, updates in updates_by_id.items():
+            row_index = rows.get(str(cid).strip())
+            if row_index:
+                data.extend(self._cells(row_index, updates))
+        if data:
+            self._call(lambda ws: ws.batch_update(data, value_input_option="USER_ENTERED"), retry=False)
+
+        return [cid for cid in updates_by_id if str(cid).strip() not in rows]
 
     # ======================================================
     # ✅ Получение всех данных (для отчётов)
     # ======================================================
-    def get_all_data(self):
-        """Возвращает все строки таблицы в виде DataFrame"""
-        try:
-            data = self.sheet.get_all_values()
-            if not data or len(data) < 2:
-                return pd.DataFrame()
-            df = pd.DataFrame(data[1:], columns=data[0])
-            return df
-        except Exception as e:
-            print(f"⚠️ Ошибка при получении всех данных: {e}")
-            return pd.DataFrame()
+    def get_all_values(self):
+        """Все строки листа как есть (включая заголовок)"""
+        return self._call(lambda ws: ws.get_all_values())
 
-    # ======================================================
-    # ✅ Фильтрация по диапазону дат
-    # ======================================================
-    def get_by_date_range(self, start_date: str, end_date: str):
-        """Возвращает жалобы за выбранный диапазон дат"""
-        df = self.get_all_data()
-        if df.empty or "Дата" not in df.columns:
-            return pd.DataFrame()
-
-        df["Дата"] = pd.to_datetime(df["Дата"], errors="coerce", format="%d.%m.%Y %H:%M")
-        mask = (df["Дата"] >= pd.to_datetime(start_date)) & (df["Дата"] <= pd.to_datetime(end_date))
-        return df.loc[mask]
+
+# ======================================================
+# ⚡ Асинхронная обёртка (запросы вне event loop)
+# ======================================================
+class AsyncSheetsClient:
+    """
+    Выполняет синхронные запросы GoogleSheetsClient в отдельном пуле потоков,
+    чтобы диспетчер aiogram продолжал обрабатывать апдейты во время I/O.
+    Размер пула — ограничение одновременных запросов к Google (квота).
+    """
+
+    def __init__(self, gs: GoogleSheetsClient, max_concurrency: int = 4):
+        self.gs = gs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="sheets"
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Запускает произвольную синхронную функцию в пуле Sheets"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def connect(self):
+        return await self.run(self.gs.connect)
+
+    async def add_complaints(self, complaints: list):
+        return await self.run(self.gs.add_complaints, complaints)
+
+    async def update_many(self, updates_by_id: dict):
+        return await self.run(self.gs.update_many, updates_by_id)
+
+    async def get_all_values(self):
+        return await self.run(self.gs.get_all_values)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -4,7 +4,6 @@ from aiogram import Router, types, F
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from google_sheets import GoogleSheetsClient
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
@@ -19,6 +18,11 @@ import re
 
 router = Router()
 from aiogram import Bot
+from fsm_storage import BufferedFSMMiddleware
+
+# состояние анкеты читается один раз за апдейт и пишется одной операцией в конце
+router.message.middleware(BufferedFSMMiddleware())
+router.callback_query.middleware(BufferedFSMMiddleware())
 
 # Инициализация глобальных контейнеров для блокировок и ожиданий
 def setup_bot_memory(bot: Bot):
@@ -77,40 +81,12 @@ def make_categories_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-# ==========================
-# Генерация "красивого" ID A-1, A-2...
-# ==========================
-def generate_pretty_id(gs_client: GoogleSheetsClient) -> str:
-    """Генерирует новый ID без get_all_records()"""
-    try:
-        values = gs_client.sheet.col_values(1)  # читаем только первый столбец
-        ids = [v for v in values if v.startswith("A-")]
-        if not ids:
-            return "A-1"
-        last_num = max(int(i.split("-")[1]) for i in ids if i.split("-")[1].isdigit())
-        return f"A-{last_num + 1}"
-    except Exception as e:
-        print(f"⚠️ generate_pretty_id error: {e}")
-        return f"A-{uz_time().strftime('%y%m%d%H%M%S')}"
-
 # ==========================
 # 📋 Показ предпросмотра жалобы с поддержкой фото/видео/документов
 # ==========================
 async def show_complaint_preview(message: types.Message, state: FSMContext):
     data = await state.get_data()
 
-    # ID без коллизий
-    try:
-        gs_client = GoogleSheetsClient(
-            message.bot.config["SERVICE_ACCOUNT_FILE"],
-            message.bot.config["GOOGLE_SHEET_ID"]
-        )
-        complaint_id = generate_pretty_id(gs_client)
-    except Exception:
-        complaint_id = f"A-{uz_time().strftime('%y%m%d%H%M%S')}"
-
-    await state.update_data(id=complaint_id)
-
     branch = data.get("branch", "-")
     parent = data.get("parent", "-")
     student = data.get("student", "-")
@@ -483,7 +459,8 @@ async def edit_form(callback: types.CallbackQuery, state: FSMContext):
 
 # ==========================
 # Подтверждение и отправка жалобы
-# — защита от повторной отправки: _sent_ids
+# — защита от повторной отправки: _sent_ids (по сообщению предпросмотра)
+#   и блокировка на пользователя — работают и между воркерами
 # ==========================
 @router.callback_query(F.data == "confirm_send")
 async def confirm_send(callback: types.CallbackQuery, state: FSMContext):
@@ -492,13 +469,42 @@ async def confirm_send(callback: types.CallbackQuery, state: FSMContext):
     except:
         pass
 
-    data = await state.get_data()
-    if data.get("sending_in_progress"):
+    bot = callback.bot
+    # предпросмотр отмечается ДО отправки: второе нажатие сюда уже не пройдёт
+    preview_key = f"{callback.message.chat.id}:{callback.message.message_id}"
+    if not bot._sent_ids.add_if_absent(preview_key):
+        await callback.message.answer("✅ Эта жалоба уже отправлена.")
+        return
+
+    lock_key = f"confirm_send:{callback.from_user.id}"
+    if not await bot.lock_manager.acquire(lock_key):
+        bot._sent_ids.discard(preview_key)
         await callback.message.answer("⚠️ Жалоба уже отправляется, подождите пару секунд.")
         return
 
-    await state.update_data(sending_in_progress=True)
-    complaint_id = data.get("id") or f"A-{uz_time().strftime('%y%m%d%H%M%S')}"
+    sent = False
+    try:
+        sent = await send_complaint(callback, state)
+    finally:
+        bot.lock_manager.release(lock_key)
+        if not sent:
+            # не отправилась — кнопка снова доступна для повтора
+            bot._sent_ids.discard(preview_key)
+
+
+async def send_complaint(callback: types.CallbackQuery, state: FSMContext) -> bool:
+    """Сохраняет жалобу и отправляет её в группу ЖАЛОБЫ; True — успешно"""
+    data = await state.get_data()
+
+    # ID выдаётся только при отправке (повторная попытка использует тот же ID)
+    complaint_id = data.get("id")
+    if not complaint_id:
+        try:
+            complaint_id = await callback.bot.ids.next_id()
+        except Exception as e:
+            print(f"⚠️ Ошибка выдачи ID: {e}")
+            complaint_id = f"A-{uz_time().strftime('%y%m%d%H%M%S')}"
+        await state.update_data(id=complaint_id)
     date_str = uz_time().strftime("%d.%m.%Y %H:%M")
 
     branch = data.get("branch", "-")
@@ -528,11 +534,7 @@ async def confirm_send(callback: types.CallbackQuery, state: FSMContext):
     )
 
     try:
-        gs = GoogleSheetsClient(
-            callback.bot.config["SERVICE_ACCOUNT_FILE"],
-            callback.bot.config["GOOGLE_SHEET_ID"]
-        )
-        gs.add_complaint({
+        callback.bot.store.add_complaint({
             "ID": complaint_id,
             "Дата": date_str,
             "Филиал": branch,
@@ -549,8 +551,7 @@ async def confirm_send(callback: types.CallbackQuery, state: FSMContext):
         })
     except Exception as e:
         await callback.message.answer(f"⚠️ Ошибка при сохранении в таблицу: {e}")
-        await state.update_data(sending_in_progress=False)
-        return
+        return False
 
     group_id = callback.bot.config["GROUP_COMPLAINTS_ID"]
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -605,10 +606,11 @@ async def confirm_send(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.answer("✅ Жалоба успешно отправлена и сохранена.", reply_markup=main_menu_kb())
 
         await state.clear()
+        return True
 
     except Exception as e:
         await callback.message.answer(f"⚠️ Ошибка при отправке в группу: {e}")
-        await state.update_data(sending_in_progress=False)
+        return False
 
 # ---------------------------------------------------------
 # ✔ Память решений — хранит активные решения
@@ -637,14 +639,12 @@ async def called_handler(callback: types.CallbackQuery):
 
     await callback.answer("⏳ Обрабатываю...")
 
-    # защита от повторных нажатий
-    if cid in bot._called_ids:
+    # защита от повторных нажатий (атомарно — и между воркерами)
+    if not bot._called_ids.add_if_absent(cid):
         return
-    bot._called_ids.add(cid)
 
     # обновляем таблицу
-    gs = GoogleSheetsClient(bot.config["SERVICE_ACCOUNT_FILE"], bot.config["GOOGLE_SHEET_ID"])
-    gs.update_by_id(cid, {
+    bot.store.update_by_id(cid, {
         "Статус": "Принята",
         "Время обзвона": now
     })
@@ -790,28 +790,24 @@ async def receive_solution(message: types.Message):
         await message.answer("❌ Решение слишком короткое.")
         return
 
-    # загружаем жалобу
-    gs = GoogleSheetsClient(bot.config["SERVICE_ACCOUNT_FILE"], bot.config["GOOGLE_SHEET_ID"])
-    _, complaint = gs.get_row_by_id(cid)
-
-    if not complaint:
-        await message.answer(f"⚠️ Жалоба {cid} не найдена.")
-        bot.active_solutions.pop(user_id, None)
-        return
-
-    # обновляем таблицу
+    # обновляем таблицу — в ответ получаем актуальную запись жалобы
     now = uz_time().strftime("%d.%m.%Y %H:%M")
     responsible = message.from_user.full_name or "Без имени"
     username = f"@{message.from_user.username}" if message.from_user.username else ""
     responsible_display = f"{responsible} {username}".strip()
 
-    gs.update_by_id(cid, {
+    complaint = bot.store.update_by_id(cid, {
         "Решение": solution_text,
         "Ответственный": responsible_display,
         "Время решения": now,
         "Статус": "Ожидает уведомления"
     })
 
+    if not complaint:
+        await message.answer(f"⚠️ Жалоба {cid} не найдена.")
+        bot.active_solutions.pop(user_id, None)
+        return
+
     # данные отправителя жалобы
     sender = complaint.get("Отправитель", "—")
     sender_uid = complaint.get("User ID", "—")
@@ -890,8 +886,7 @@ async def notify_parent(callback: types.CallbackQuery):
     un = f"@{callback.from_user.username}" if callback.from_user.username else ""
     display = f"{user} {un}".strip()
 
-    gs = GoogleSheetsClient(callback.bot.config["SERVICE_ACCOUNT_FILE"], callback.bot.config["GOOGLE_SHEET_ID"])
-    gs.update_by_id(cid, {
+    callback.bot.store.update_by_id(cid, {
         "Статус": "Закрыта",
         "Время уведомления": now,
         "Кто уведомил родителя": display
@@ -1,7 +1,9 @@
 import pandas as pd
 from aiogram import Router, types, F
-from google_sheets import GoogleSheetsClient
+from aiogram.filters import Command
 from datetime import datetime
+from metrics import metrics
+from stats_engine import STATUS_FIELDS
 
 router = Router()
 
@@ -14,15 +16,43 @@ def format_progress(closed, total):
         return "0%"
     return f"{round((closed / total) * 100)}%"
 
-def generate_summary(df):
+def format_last_date(cube, since=None):
+    """Дата последней жалобы"""
+    last = cube.last_activity(since)
+    return last.strftime("%d.%m.%Y") if pd.notna(last) else "—"
+
+def format_counts(row, labels):
+    """Блок с итогами по статусам для одной строки сводки"""
+    lines = [f"{labels['total']} {row['total']}"]
+    lines += [f"{labels[field]} {row[field]}" for field in STATUS_FIELDS]
+    lines.append(f"📈 Прогресс закрытия: {format_progress(row['notified'], row['total'])}")
+    return "\n".join(lines)
+
+FULL_LABELS = {
+    "total": "📋 Всего жалоб:",
+    "waiting": "📞 Ожидают перезвона:",
+    "called": "💬 Ожидают решения:",
+    "solution": "🪪 Ожидают уведомления:",
+    "notified": "✅ Закрыто:",
+}
+
+SHORT_LABELS = {
+    "total": "📋 Всего:",
+    "waiting": "📞 Перезвон:",
+    "called": "💬 Решение:",
+    "solution": "🪪 Уведомление:",
+    "notified": "✅ Закрыто:",
+}
+
+def generate_summary(cube, since=None):
     """Создаёт общий аналитический вывод"""
-    if df.empty:
+    branch_counts = cube.summary(by="Филиал", since=since)["total"]
+    if branch_counts.empty:
         return "\n⚠️ Нет данных для анализа."
 
-    branch_counts = df["Филиал"].value_counts()
     max_branch = branch_counts.idxmax()
     min_branch = branch_counts.idxmin()
-    last_date = pd.to_datetime(df["Дата"], errors="coerce", dayfirst=True).max().strftime("%d.%m.%Y")
+    last_date = format_last_date(cube, since)
 
     return (
         f"\n━━━━━━━━━━━━━━━━━━━\n"
@@ -35,16 +65,20 @@ def generate_summary(df):
 # 🔒 Проверка, что пользователь — админ
 # ==============================
 async def is_admin(bot, user_id: int) -> bool:
-    """Проверяет, является ли пользователь админом в группе жалоб"""
+    """Проверяет, является ли пользователь админом в группе жалоб (или в ADMINS)"""
     try:
-        group_id = bot.config["GROUP_SOLUTIONS_ID"]
-        admins = await bot.get_chat_administrators(group_id)
-        admin_ids = [admin.user.id for admin in admins]
-        return user_id in admin_ids
+        return await bot.admins.is_admin(bot.config["GROUP_SOLUTIONS_ID"], user_id)
     except Exception as e:
         print(f"⚠️ Ошибка проверки прав: {e}")
         return False
 
+
+@router.chat_member()
+@router.my_chat_member()
+async def admin_changed(event: types.ChatMemberUpdated):
+    """Назначение/снятие админа — сразу обновляем кэш прав"""
+    event.bot.admins.on_member_update(event)
+
 # ==============================
 # 📊 Общая статистика
 # ==============================
@@ -58,36 +92,21 @@ async def show_main_statistics(message: types.Message):
         await message.answer("⛔ У вас нет прав для просмотра статистики.")
         return
 
-    try:
-        gs = GoogleSheetsClient(message.bot.config["SERVICE_ACCOUNT_FILE"], message.bot.config["GOOGLE_SHEET_ID"])
-        df = gs.get_all_data()
-    except Exception as e:
-        await message.answer(f"⚠️ Ошибка при загрузке данных: {e}")
-        return
-
-    if df.empty:
+    # живые счётчики — без пересчёта по строкам
+    counters = message.bot.counters
+    counters.refresh()
+    if counters.empty:
         await message.answer("⚠️ Данных пока нет.")
         return
 
-    total = len(df)
-    waiting = (df["Статус"] == "Ожидает обзвона").sum()
-    called = (df["Статус"] == "Принята").sum()
-    solution = (df["Статус"] == "Ожидает уведомления").sum()
-    notified = (df["Статус"] == "Закрыта").sum()
-    progress = format_progress(notified, total)
-
+    totals = counters.summary().iloc[0]
     text = (
         "<b>📊 ОБЩАЯ СТАТИСТИКА</b>\n"
         "━━━━━━━━━━━━━━━━━━━\n"
-        f"📋 Всего жалоб: {total}\n"
-        f"📞 Ожидают перезвона: {waiting}\n"
-        f"💬 Ожидают решения: {called}\n"
-        f"🪪 Ожидают уведомления: {solution}\n"
-        f"✅ Закрыто: {notified}\n"
-        f"📈 Прогресс закрытия: {progress}"
+        + format_counts(totals, FULL_LABELS)
     )
 
-    text += generate_summary(df)
+    text += generate_summary(counters)
 
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="🏫 По филиалам", callback_data="stats_by_branch")],
@@ -107,32 +126,16 @@ async def stats_by_branch(callback: types.CallbackQuery):
         await callback.answer("⛔ Нет доступа.", show_alert=True)
         return
 
-    gs = GoogleSheetsClient(callback.bot.config["SERVICE_ACCOUNT_FILE"], callback.bot.config["GOOGLE_SHEET_ID"])
-    df = gs.get_all_data()
-    if df.empty:
+    cube = callback.bot.stats_cache.get()
+    if cube.empty:
         await callback.message.answer("⚠️ Данных нет.")
         return
 
     text = "<b>🏫 СТАТИСТИКА ПО ФИЛИАЛАМ</b>\n━━━━━━━━━━━━━━━━━━━"
-    for branch, b_df in df.groupby("Филиал"):
-        total = len(b_df)
-        waiting = (b_df["Статус"] == "Ожидает обзвона").sum()
-        called = (b_df["Статус"] == "Принята").sum()
-        solution = (b_df["Статус"] == "Ожидает уведомления").sum()
-        notified = (b_df["Статус"] == "Закрыта").sum()
-        progress = format_progress(notified, total)
-
-        text += (
-            f"\n\n🏫 <b>{branch}</b>\n"
-            f"📋 Всего: {total}\n"
-            f"📞 Перезвон: {waiting}\n"
-            f"💬 Решение: {called}\n"
-            f"🪪 Уведомление: {solution}\n"
-            f"✅ Закрыто: {notified}\n"
-            f"📈 Прогресс закрытия: {progress}"
-        )
-
-    text += generate_summary(df)
+    for branch, row in cube.summary(by="Филиал").iterrows():
+        text += f"\n\n🏫 <b>{branch}</b>\n" + format_counts(row, SHORT_LABELS)
+
+    text += generate_summary(cube)
     await callback.message.answer(text, parse_mode="HTML")
 
 # ==============================
@@ -145,13 +148,12 @@ async def stats_by_category(callback: types.CallbackQuery):
         return
 
     try:
-        gs = GoogleSheetsClient(callback.bot.config["SERVICE_ACCOUNT_FILE"], callback.bot.config["GOOGLE_SHEET_ID"])
-        df = gs.get_all_data()
+        cube = callback.bot.stats_cache.get()
     except Exception as e:
         await callback.message.answer(f"⚠️ Ошибка загрузки данных: {e}")
         return
 
-    if df.empty or "Категория" not in df.columns:
+    if cube.empty:
         await callback.message.answer("⚠️ Нет данных по категориям.")
         return
 
@@ -168,29 +170,14 @@ async def stats_by_category(callback: types.CallbackQuery):
     text = "<b>📂 СТАТИСТИКА ПО КАТЕГОРИЯМ</b>\n━━━━━━━━━━━━━━━━━━━"
     cat_summary = {}
 
+    by_category = cube.summary(by="Категория")
     for cat in categories_order:
-        c_df = df[df["Категория"] == cat]
-        if c_df.empty:
+        if cat not in by_category.index:
             continue
 
-        total = len(c_df)
-        waiting = (c_df["Статус"] == "Ожидает обзвона").sum()
-        called = (c_df["Статус"] == "Принята").sum()
-        solution = (c_df["Статус"] == "Ожидает уведомления").sum()
-        notified = (c_df["Статус"] == "Закрыта").sum()
-        progress = format_progress(notified, total)
-
-        cat_summary[cat] = total
-
-        text += (
-            f"\n\n📂 <b>{cat}</b>\n"
-            f"📋 Всего жалоб: {total}\n"
-            f"📞 Ожидают перезвона: {waiting}\n"
-            f"💬 Ожидают решения: {called}\n"
-            f"🪪 Ожидают уведомления: {solution}\n"
-            f"✅ Закрыто: {notified}\n"
-            f"📈 Прогресс закрытия: {progress}"
-        )
+        row = by_category.loc[cat]
+        cat_summary[cat] = row["total"]
+        text += f"\n\n📂 <b>{cat}</b>\n" + format_counts(row, FULL_LABELS)
 
     if not cat_summary:
         await callback.message.answer("⚠️ Нет данных по категориям.")
@@ -201,9 +188,7 @@ async def stats_by_category(callback: types.CallbackQuery):
     most_count = cat_summary[most_complaints_cat]
     least_count = cat_summary[least_complaints_cat]
 
-    df["Дата"] = pd.to_datetime(df["Дата"], errors="coerce", dayfirst=True)
-
-    last_date = df["Дата"].max().strftime("%d.%m.%Y")
+    last_date = format_last_date(cube)
 
     text += (
         "\n━━━━━━━━━━━━━━━━━━━\n"
@@ -223,34 +208,21 @@ async def stats_by_date(callback: types.CallbackQuery):
         await callback.answer("⛔ Нет доступа.", show_alert=True)
         return
 
-    gs = GoogleSheetsClient(callback.bot.config["SERVICE_ACCOUNT_FILE"], callback.bot.config["GOOGLE_SHEET_ID"])
-    df = gs.get_all_data()
-    if df.empty or "Дата" not in df.columns:
+    cube = callback.bot.stats_cache.get()
+    if cube.empty:
         await callback.message.answer("⚠️ Нет данных по датам.")
         return
 
-    df["Дата"] = pd.to_datetime(df["Дата"], errors="coerce", dayfirst=True)
-
-    last_7 = df[df["Дата"] >= datetime.now() - pd.Timedelta(days=7)]
-
-    total = len(last_7)
-    waiting = (last_7["Статус"] == "Ожидает обзвона").sum()
-    called = (last_7["Статус"] == "Принята").sum()
-    solution = (last_7["Статус"] == "Ожидает уведомления").sum()
-    notified = (last_7["Статус"] == "Закрыта").sum()
-    progress = format_progress(notified, total)
+    since = datetime.now() - pd.Timedelta(days=7)
+    totals = cube.summary(since=since)
+    totals = totals.iloc[0] if not totals.empty else pd.Series(0, index=["total"] + list(STATUS_FIELDS))
 
     text = (
         "<b>📅 СТАТИСТИКА ЗА 7 ДНЕЙ</b>\n━━━━━━━━━━━━━━━━━━━\n"
-        f"📋 Всего жалоб: {total}\n"
-        f"📞 Перезвон: {waiting}\n"
-        f"💬 Решение: {called}\n"
-        f"🪪 Уведомление: {solution}\n"
-        f"✅ Закрыто: {notified}\n"
-        f"📈 Прогресс закрытия: {progress}"
+        + format_counts(totals, {**SHORT_LABELS, "total": "📋 Всего жалоб:"})
     )
 
-    text += generate_summary(last_7)
+    text += generate_summary(cube, since=since)
     await callback.message.answer(text, parse_mode="HTML")
 
 # ==============================
@@ -262,16 +234,26 @@ async def stats_download(callback: types.CallbackQuery):
         await callback.answer("⛔ Нет доступа.", show_alert=True)
         return
 
-    gs = GoogleSheetsClient(callback.bot.config["SERVICE_ACCOUNT_FILE"], callback.bot.config["GOOGLE_SHEET_ID"])
-    df = gs.get_all_data()
-    if df.empty:
+    if callback.bot.stats_cache.get().df.empty:
         await callback.message.answer("⚠️ Нет данных для выгрузки.")
         return
 
-    file_path = "/tmp/statistics.xlsx"
-    df.to_excel(file_path, index=False)
+    # файл собирается в отдельном процессе прямо из базы, на диск не пишется
+    data = await callback.bot.exporter.export()
 
     await callback.message.answer_document(
-        document=types.FSInputFile(file_path),
+        document=types.BufferedInputFile(data, filename="statistics.xlsx"),
         caption="📊 Полный отчёт по жалобам."
     )
+
+
+# ==============================
+# 📈 Метрики бота
+# ==============================
+@router.message(Command("metrics"))
+async def show_metrics(message: types.Message):
+    if not await is_admin(message.bot, message.from_user.id):
+        await message.answer("⛔ У вас нет прав для просмотра метрик.")
+        return
+
+    await message.answer(f"<b>📈 МЕТРИКИ</b>\n<pre>{metrics.render()}</pre>", parse_mode="HTML")
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+
+
+# ============================
+# 🆔 Выдача ID жалоб A-1, A-2...
+# ============================
+class IdAllocator:
+    """
+    Хранит последний выданный номер в памяти и в файле.
+    Таблица читается только если файла счётчика нет (первый запуск).
+    """
+
+    def __init__(self, path: str, seed=None, prefix: str = "A", shared=None):
+        self.path = path
+        self.prefix = prefix
+        # shared — SharedState: номер берётся из общего счётчика (несколько воркеров)
+        self._shared = shared
+        # seed — async-функция, возвращающая уже существующие ID
+        self._seed = seed
+        self._last = None
+        self._lock = asyncio.Lock()
+
+    def _parse(self, value) -> int | None:
+        head, _, num = str(value).strip().partition("-")
+        if head != self.prefix or not num.isdigit():
+            return None
+        return int(num)
+
+    def _read_file(self) -> int | None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["last"])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Файл счётчика ID повреждён ({e}) — пересчитываю по таблице.")
+            return None
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last": self._last}, f)
+        os.replace(tmp_path, self.path)
+
+    async def _load(self):
+        last = self._read_file()
+        if last is None:
+            known = await self._seed() if self._seed else []
+            numbers = [n for n in (self._parse(v) for v in known) if n is not None]
+            last = max(numbers, default=0)
+            print(f"🆔 Счётчик ID инициализирован по таблице: {self.prefix}-{last}")
+        self._last = last
+        self._save()
+
+    async def load(self):
+        """Загружает счётчик заранее (при запуске бота)"""
+        async with self._lock:
+            if self._last is None:
+                await self._load()
+
+    async def next_id(self) -> str:
+        """Атомарно выдаёт следующий ID"""
+        async with self._lock:
+            if self._last is None:
+                await self._load()
+            if self._shared is not None:
+                # файл/таблица задают только нижнюю границу общего счётчика
+                self._last = self._shared.incr(f"ids:{self.prefix}", floor=self._last)
+            else:
+                self._last += 1
+            self._save()
+            return f"{self.prefix}-{self._last}"
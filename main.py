@@ -1,5 +1,6 @@
 import json
 import os
+import re
 
 # Создаём service_account.json на Railway
 if os.getenv("SERVICE_ACCOUNT_JSON"):
@@ -8,10 +9,26 @@ if os.getenv("SERVICE_ACCOUNT_JSON"):
 
 import asyncio
 import logging
+from datetime import timedelta
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from scheduler import start_scheduler
+from google_sheets import GoogleSheetsClient, AsyncSheetsClient
+from id_allocator import IdAllocator
+from complaint_store import ComplaintStore
+from replicator import start_replicator, import_from_sheets
+from stats_cache import StatsCache
+from stats_engine import STATUS_CLOSED, StatsCube, StatsCounters
+from sla_timers import SlaTimers
+from shared_state import LockManager, open_shared_state
+from admin_cache import AdminCache
+from excel_export import ExcelExporter
+from rollups import DailyRollups
+from send_queue import OutboundQueue
+from fsm_storage import SQLiteStorage
+from webhook import run_webhook, setup_graceful_shutdown
 
 # ======================================
 # 🔧 НАСТРОЙКИ
@@ -24,9 +41,80 @@ GROUP_LEADERS_ID = -1003284967767        # группа "РУКОВОДСТВО"
 
 GOOGLE_SHEET_ID = "1XP4m-yo3_-Y2QPP49af2VmNFcvwXxB9ig1wVWV2gujk"
 SERVICE_ACCOUNT_FILE = "service_account.json"
+ID_COUNTER_FILE = os.getenv("ID_COUNTER_FILE", "id_counter.json")
+DATABASE_FILE = os.getenv("DATABASE_FILE", "complaints.db")
+# полная перезагрузка данных в памяти (между ними — только изменённые строки)
+STORE_FULL_RESYNC_SECONDS = 3600
+# сколько секунд живёт снимок данных для статистики (сбрасывается при изменениях)
+STATS_CACHE_TTL = 60
+# через сколько часов напоминать о жалобе, которую не обзвонили
+SLA_CALL_HOURS = 2
+# сколько дней помнить нажатые кнопки и сообщения жалоб (для редактирования)
+DEDUP_TTL_DAYS = 30
+# защита от двойного клика «Пропустить»
+SKIP_DEBOUNCE_SECONDS = 1.5
+# сколько записей служебного состояния держать в памяти (на коллекцию)
+STATE_CAP = 5000
+# сколько ждать текст решения после «Добавить решение»
+SOLUTION_INPUT_TTL = 24 * 3600
+# брошенные анкеты удаляются через N дней; запись шага анкеты — одной пачкой через N мс
+FSM_TTL_DAYS = 7
+FSM_FLUSH_DELAY_MS = 300
+
+# режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")            # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# обязателен в режиме webhook и одинаков у всех воркеров (Telegram шлёт его в каждом запросе)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+# свой Bot API сервер (локальный или тестовый), например http://localhost:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# сколько ждать хендлеры и очередь Google Sheets при остановке
+SHUTDOWN_TIMEOUT = 30
+
+if BOT_MODE == "webhook":
+    # случайный секрет у каждого процесса ломает приём апдейтов после рестарта
+    # и при нескольких воркерах — поэтому без явных настроек не запускаемся
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook: задайте WEBHOOK_SECRET (одинаковый для всех воркеров)")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        raise RuntimeError("WEBHOOK_SECRET: 1–256 символов A-Z, a-z, 0-9, _ и -")
+    # настоящий Bot API принимает только https; свой сервер (TELEGRAM_API_URL) — и http://localhost
+    scheme = "https?" if TELEGRAM_API_URL else "https"
+    if not re.fullmatch(rf"{scheme}://[^/\s]+(/\S*)?", WEBHOOK_URL):
+        raise RuntimeError(
+            f"BOT_MODE=webhook: WEBHOOK_URL {WEBHOOK_URL!r} — нужен https://..., http:// только с TELEGRAM_API_URL"
+        )
+
+# как часто обновлять список админов группы (плюс сразу по chat_member)
+ADMIN_CACHE_TTL = 600
+
+# несколько воркеров на одной базе: общее состояние читается без кэша в памяти
+MULTI_WORKER = os.getenv("MULTI_WORKER", "0") == "1"
+# бэкенд общего состояния (блокировки, дедупликация, message_id)
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", f"sqlite:///{DATABASE_FILE}")
 
 TIMEZONE = "Asia/Tashkent"
 
+# одновременных запросов к Google Sheets (квота API)
+SHEETS_MAX_CONCURRENCY = 4
+# запись в таблицу пачками: ждём до N мс или до N строк
+SHEETS_FLUSH_DELAY_MS = 500
+SHEETS_BATCH_SIZE = 100
+
+# процессы для сборки Excel (отчёты и «Скачать Excel»)
+EXPORT_WORKERS = 1
+
+# лимиты отправки Telegram: сообщений в секунду на личный чат / группу / всего
+SEND_RATE_PRIVATE = 1.0
+SEND_RATE_GROUP = 20 / 60
+SEND_RATE_GLOBAL = 30.0
+# сколько раз повторять запрос после TelegramRetryAfter
+SEND_MAX_RETRIES = 3
+
+
 # ======================================
 # 🔇 ЛОГИ
 # ======================================
@@ -43,38 +131,75 @@ logging.getLogger("aiogram").setLevel(logging.INFO)
 # ======================================
 bot = Bot(
     token=BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode="HTML")
+    default=DefaultBotProperties(parse_mode="HTML"),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+)
+
+# все отправки и правки сообщений — через очередь с лимитами по чатам
+bot.outbound = OutboundQueue(
+    private_rate=SEND_RATE_PRIVATE, group_rate=SEND_RATE_GROUP,
+    global_rate=SEND_RATE_GLOBAL, max_retries=SEND_MAX_RETRIES,
 )
+bot.session.middleware(bot.outbound)
 
 # ======================================
-# 🔒 МЕНЕДЖЕР БЛОКИРОВОК
+# 🤝 Общее состояние воркеров: блокировки, дедупликация, message_id
+# ======================================
+bot.shared = open_shared_state(SHARED_STATE_URL)
+bot.lock_manager = LockManager(bot.shared)
+
 # ======================================
-class LockManager:
-    def __init__(self):
-        self._locks = {}
+# 📗 Google Sheets — один клиент на процесс
+# ======================================
+bot.gs = GoogleSheetsClient(SERVICE_ACCOUNT_FILE, GOOGLE_SHEET_ID)
+# асинхронный фасад — все вызовы из хендлеров идут через него
+bot.sheets = AsyncSheetsClient(bot.gs, max_concurrency=SHEETS_MAX_CONCURRENCY)
+
+# ======================================
+# 🗄 Локальная база жалоб (основная), Google Sheets — реплика
+# ======================================
+bot.store = ComplaintStore(DATABASE_FILE, full_resync_interval=STORE_FULL_RESYNC_SECONDS)
+
+# снимок для статистики — сбрасывается при каждом изменении жалобы
+# (confirm_send, called_handler, receive_solution, notify_parent пишут через store)
+bot.stats_cache = StatsCache(lambda: StatsCube(bot.store.get_all_data()), ttl=STATS_CACHE_TTL)
+bot.store.subscribe(lambda before, after: bot.stats_cache.invalidate())
+
+# живые счётчики для общей статистики — обновляются при каждом переходе статуса,
+# пересобираются из базы при запуске и после импорта из таблицы
+bot.counters = StatsCounters(bot.store.get_all_data, version=bot.store.last_seq)
+bot.store.subscribe(bot.counters.on_change)
 
-    async def acquire(self, user_id: int) -> bool:
-        if user_id in self._locks:
-            return False
-        lock = asyncio.Lock()
-        self._locks[user_id] = lock
-        await lock.acquire()
-        return True
+# сроки напоминаний об обзвоне: ставятся при создании жалобы, снимаются при обзвоне
+bot.sla = SlaTimers(DATABASE_FILE, bot.store.get_all_data, delay=timedelta(hours=SLA_CALL_HOURS))
+bot.store.subscribe(bot.sla.on_change)
 
-    def release(self, user_id: int):
-        lock = self._locks.get(user_id)
-        if lock and lock.locked():
-            lock.release()
-        if user_id in self._locks:
-            del self._locks[user_id]
+# дневные агрегаты для недельных/месячных отчётов — ведутся триггерами базы
+# в одной транзакции с жалобой (из истории заполняются при первом запуске)
+bot.rollups = DailyRollups(DATABASE_FILE)
 
-bot.lock_manager = LockManager()
+# выгрузки Excel — в отдельном процессе, читают базу сами
+bot.exporter = ExcelExporter(DATABASE_FILE, workers=EXPORT_WORKERS)
+
+
+# ======================================
+# 🆔 Счётчик ID жалоб (база читается только при отсутствии файла)
+# ======================================
+async def _known_ids():
+    return bot.store.known_ids()
+
+bot.ids = IdAllocator(ID_COUNTER_FILE, seed=_known_ids, shared=bot.shared)
 
 # ======================================
 # FSM и диспетчер
 # ======================================
-storage = MemoryStorage()
+# незаконченные анкеты переживают перезапуск (закрывается диспетчером при остановке)
+storage = SQLiteStorage(
+    DATABASE_FILE, ttl=FSM_TTL_DAYS * 86400, flush_delay=FSM_FLUSH_DELAY_MS / 1000, shared=MULTI_WORKER
+)
 dp = Dispatcher(storage=storage)
+# при остановке — дождаться хендлеров и отправить очередь в Google Sheets
+setup_graceful_shutdown(dp, bot)
 
 # Импорт хендлеров
 from handlers import complaints, statistics
@@ -87,12 +212,27 @@ dp.include_router(statistics.router)
 # 🔹 Данные в bot
 # --------------------------------------
 bot.data = {"cancelled": {}}
-bot._sent_ids = set()
-bot._called_ids = set()
-bot.solution_messages = {}
-bot.notify_messages = {}
-bot.active_solutions = {}
-bot.solution_waiting = {}
+# защита от повторов и message_id для редактирования — переживают перезапуск
+# и видны всем воркерам (напоминания об обзвоне отмечаются в bot.sla);
+# в памяти — не больше STATE_CAP записей, при MULTI_WORKER — всегда из базы
+DEDUP_TTL = DEDUP_TTL_DAYS * 86400
+bot._sent_ids = bot.shared.set("sent_ids", ttl=DEDUP_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+bot._called_ids = bot.shared.set("called_ids", ttl=DEDUP_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+bot._skip_cache = bot.shared.set("skip_cache", ttl=SKIP_DEBOUNCE_SECONDS, cap=STATE_CAP, shared=MULTI_WORKER)
+bot.solution_messages = bot.shared.map("solution_messages", ttl=DEDUP_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+bot.notify_messages = bot.shared.map("notify_messages", ttl=DEDUP_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+# ввод решения (по user_id): кнопку и текст может обработать разный воркер
+bot.active_solutions = bot.shared.map("active_solutions", ttl=SOLUTION_INPUT_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+bot.solution_waiting = bot.shared.map("solution_waiting", ttl=SOLUTION_INPUT_TTL, cap=STATE_CAP, shared=MULTI_WORKER)
+
+def _forget_closed(before, after):
+    """Закрытой жалобе сообщения для редактирования больше не нужны"""
+    if after and after.get("Статус") == STATUS_CLOSED:
+        bot.notify_messages.pop(after["ID"])
+        bot.solution_messages.pop(after["ID"])
+
+
+bot.store.subscribe(_forget_closed)
 
 # --------------------------------------
 # 🔹 Общая конфигурация
@@ -103,10 +243,38 @@ bot.config = {
     "GROUP_LEADERS_ID": GROUP_LEADERS_ID,
     "GOOGLE_SHEET_ID": GOOGLE_SHEET_ID,
     "SERVICE_ACCOUNT_FILE": SERVICE_ACCOUNT_FILE,
+    "ID_COUNTER_FILE": ID_COUNTER_FILE,
+    "DATABASE_FILE": DATABASE_FILE,
+    "STORE_FULL_RESYNC_SECONDS": STORE_FULL_RESYNC_SECONDS,
+    "STATS_CACHE_TTL": STATS_CACHE_TTL,
+    "SLA_CALL_HOURS": SLA_CALL_HOURS,
+    "DEDUP_TTL_DAYS": DEDUP_TTL_DAYS,
+    "STATE_CAP": STATE_CAP,
+    "FSM_TTL_DAYS": FSM_TTL_DAYS,
+    "BOT_MODE": BOT_MODE,
+    "WEBHOOK_URL": WEBHOOK_URL,
+    "WEBHOOK_PATH": WEBHOOK_PATH,
+    "WEBHOOK_SECRET": WEBHOOK_SECRET,
+    "WEBAPP_HOST": WEBAPP_HOST,
+    "WEBAPP_PORT": WEBAPP_PORT,
+    "SHUTDOWN_TIMEOUT": SHUTDOWN_TIMEOUT,
+    "MULTI_WORKER": MULTI_WORKER,
+    "ADMIN_CACHE_TTL": ADMIN_CACHE_TTL,
+    "EXPORT_WORKERS": EXPORT_WORKERS,
+    "SEND_RATE_PRIVATE": SEND_RATE_PRIVATE,
+    "SEND_RATE_GROUP": SEND_RATE_GROUP,
+    "SEND_RATE_GLOBAL": SEND_RATE_GLOBAL,
+    "SEND_MAX_RETRIES": SEND_MAX_RETRIES,
     "TIMEZONE": TIMEZONE,
+    "SHEETS_MAX_CONCURRENCY": SHEETS_MAX_CONCURRENCY,
+    "SHEETS_FLUSH_DELAY_MS": SHEETS_FLUSH_DELAY_MS,
+    "SHEETS_BATCH_SIZE": SHEETS_BATCH_SIZE,
     "ADMINS": [1450296021, 420533161]
 }
 
+# админы группы РЕШЕНИЯ (+ ADMINS) — проверка прав без запроса к Telegram
+bot.admins = AdminCache(bot, bot.config["ADMINS"], ttl=ADMIN_CACHE_TTL)
+
 # ======================================
 # 🚀 ЗАПУСК
 # ======================================
@@ -117,6 +285,23 @@ async def main():
     except:
         pass
 
+    # подключение к Google Sheets (авторизация и проверка заголовков — один раз)
+    try:
+        await bot.sheets.connect()
+        # пустая локальная база заполняется из таблицы один раз
+        await import_from_sheets(bot)
+        await bot.ids.load()
+    except Exception as e:
+        logging.warning(f"⚠️ Google Sheets недоступен при запуске, подключусь при первом запросе: {e}")
+
+    bot.counters.rebuild()
+
+    # фоновая отправка изменений в Google Sheets
+    start_replicator(bot)
+
+    # фоновое обновление списка админов
+    asyncio.create_task(bot.admins.run([GROUP_SOLUTIONS_ID]))
+
     # запуск планировщика
     try:
         start_scheduler(bot)
@@ -124,7 +309,20 @@ async def main():
         logging.warning(f"⚠️ Планировщик не запущен: {e}")
 
     print("🚀 Бот запущен и готов к работе!")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        bot.sheets.close()
+        bot.exporter.close()
+        bot.sla.close()
+        bot.rollups.close()
+        bot.shared.close()
+        bot.store.close()
 
 # ======================================
 # ▶️ ТОЧКА ВХОДА
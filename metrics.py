@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+# ============================
+# 📈 Простые метрики процесса
+# ============================
+class Metrics:
+    """
+    Счётчики, текущие значения и замеры времени в памяти.
+    Смотреть: команда /metrics (для админов).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._timings = {}
+
+    def set(self, name: str, value):
+        with self._lock:
+            self._values[name] = value
+
+    def inc(self, name: str, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        """Запоминает длительность операции: количество, сумма, максимум, последнее"""
+        with self._lock:
+            t = self._timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0})
+            t["count"] += 1
+            t["sum"] += seconds
+            t["max"] = max(t["max"], seconds)
+            t["last"] = seconds
+
+    def timer(self, name: str):
+        """with metrics.timer("name"): ... — замер блока кода"""
+        return _Timer(self, name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "values": dict(self._values),
+                "timings": {k: dict(v) for k, v in self._timings.items()},
+            }
+
+    def render(self) -> str:
+        snap = self.snapshot()
+        lines = [f"{name}: {value}" for name, value in sorted(snap["values"].items())]
+        for name, t in sorted(snap["timings"].items()):
+            avg = t["sum"] / t["count"] if t["count"] else 0.0
+            lines.append(
+                f"{name}: n={t['count']} avg={avg * 1000:.1f}ms "
+                f"max={t['max'] * 1000:.1f}ms last={t['last'] * 1000:.1f}ms"
+            )
+        return "\n".join(lines) or "нет данных"
+
+
+class _Timer:
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.monotonic() - self.started)
+        return False
+
+
+metrics = Metrics()
@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+import traceback
+from google_sheets import HEADERS, error_status, is_retryable
+from metrics import metrics
+from shared_state import Lease
+
+
+# ================================
+# 🚀 Запуск репликации
+# ================================
+def start_replicator(bot):
+    """
+    Фоновая отправка изменений из локальной базы в лист Complaints
+    (write-behind: хендлер подтверждает сразу, таблица обновляется пачками).
+    Очередь — строки с dirty = 1 в локальной базе, поэтому она переживает
+    перезапуск, а несколько изменений одной жалобы схлопываются в одну запись.
+    """
+    cfg = bot.config
+    shared = getattr(bot, "shared", None)
+    bot.replicator = SheetsReplicator(
+        bot.store,
+        bot.sheets,
+        flush_delay=cfg.get("SHEETS_FLUSH_DELAY_MS", 500) / 1000,
+        batch_size=cfg.get("SHEETS_BATCH_SIZE", 100),
+        # при нескольких воркерах таблицу пишет только один
+        lease=Lease(shared, "sheets_replicator", ttl=120) if shared else None,
+    )
+    bot.store.subscribe(lambda before, after: bot.replicator.wake())
+    asyncio.create_task(bot.replicator.run())
+    print("🔁 Репликация в Google Sheets запущена.")
+
+
+# ------------------------------
+# 📥 Первичная загрузка из таблицы
+# ------------------------------
+async def import_from_sheets(bot):
+    """Один раз заполняет пустую локальную базу данными из Google Sheets"""
+    if bot.store.is_imported():
+        return
+    values = await bot.sheets.get_all_values()
+    bot.store.import_rows(values)
+
+
+class SheetsReplicator:
+    def __init__(self, store, sheets, flush_delay: float = 0.5, batch_size: int = 100,
+                 interval: float = 30.0, max_backoff: float = 60.0, lease=None):
+        self.store = store
+        self.sheets = sheets
+        # lease() → True, если отправкой занимается этот воркер (None — всегда он)
+        self.lease = lease
+        # сколько ждать после первого изменения, собирая пачку
+        self.flush_delay = flush_delay
+        # сколько строк отправлять за один запрос (и когда не ждать flush_delay)
+        self.batch_size = batch_size
+        # страховочная проверка очереди, даже если изменений не было
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            # копим пачку: ждём flush_delay или пока не наберётся batch_size
+            deadline = time.monotonic() + self.flush_delay
+            while time.monotonic() < deadline and self.store.pending_count() < self.batch_size:
+                await asyncio.sleep(min(0.05, self.flush_delay))
+            self._wakeup.clear()
+
+            if self.lease is not None and not self.lease():
+                continue
+
+            try:
+                # база не загрузилась при запуске (Google был недоступен) — пробуем снова
+                if not self.store.is_imported():
+                    self.store.import_rows(await self.sheets.get_all_values())
+                await self.flush()
+                self._backoff = 0.0
+            except Exception as e:
+                await self._handle_error(e)
+            finally:
+                metrics.set("sheets_queue_depth", self.store.pending_count())
+
+    async def _handle_error(self, e: Exception):
+        metrics.inc("sheets_flush_errors")
+        if is_retryable(e):
+            self._backoff = min(max(self._backoff * 2, 1.0), self.max_backoff)
+            delay = self._backoff * random.uniform(0.8, 1.2)
+            print(f"⚠️ Google Sheets временно недоступен ({error_status(e) or e}) — повтор через {delay:.0f} с")
+        else:
+            traceback.print_exc()
+            self._backoff = self.max_backoff
+            delay = self._backoff
+        metrics.set("sheets_backoff_seconds", round(delay, 1))
+        await asyncio.sleep(delay)
+        metrics.set("sheets_backoff_seconds", 0)
+        self.wake()
+
+    async def flush(self):
+        """Отправляет очередь пачками: новые — append_rows, изменённые — batch_update"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        while True:
+            pending = self.store.pending_replication(self.batch_size)
+            metrics.set("sheets_queue_depth", self.store.pending_count())
+            if not pending:
+                return
+
+            with metrics.timer("sheets_flush_seconds"):
+                changed = {
+                    item["record"]["ID"]: {h: item["record"][h] for h in HEADERS if h != "ID"}
+                    for item in pending if item["in_sheet"]
+                }
+                new_ids = {item["record"]["ID"] for item in pending if not item["in_sheet"]}
+
+                if changed:
+                    # строки, которых нет в таблице (удалены вручную), добавляем заново
+                    new_ids.update(await self.sheets.update_many(changed))
+                if new_ids:
+                    await self.sheets.add_complaints(
+                        [item["record"] for item in pending if item["record"]["ID"] in new_ids]
+                    )
+
+            for item in pending:
+                self.store.mark_replicated(item["record"]["ID"], item["rev"])
+            metrics.inc("sheets_rows_flushed", len(pending))
+
+    async def drain(self, timeout: float = 30.0):
+        """Отправляет всю очередь перед остановкой (не дольше timeout секунд)"""
+        if self.lease is not None and not self.lease():
+            return
+        deadline = time.monotonic() + timeout
+        while self.store.pending_count() and time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(self.flush(), timeout=max(0.1, deadline - time.monotonic()))
+            except Exception as e:
+                print(f"⚠️ Не удалось отправить очередь в Google Sheets при остановке: {error_status(e) or e}")
+                await asyncio.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+        left = self.store.pending_count()
+        if self.lease is not None:
+            self.lease.release()
+        if left:
+            print(f"⚠️ В очереди Google Sheets осталось {left} строк — отправятся после запуска")
+        else:
+            print("✅ Очередь Google Sheets отправлена")
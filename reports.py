@@ -1,60 +1,46 @@
 import pandas as pd
-from datetime import datetime
-from google_sheets import GoogleSheetsClient
-import os
+from aiogram.types import BufferedInputFile
 
 
 # ============================
 # 📊 Формирование отчёта
 # ============================
-def generate_summary(df: pd.DataFrame):
-    """Создаёт агрегированный отчёт по филиалам."""
-    if df.empty:
-        return pd.DataFrame(columns=["Филиал", "Всего", "Решено", "В работе", "Эффективность %"])
-
-    # Определяем нужные колонки
-    branch_col, status_col = None, None
-    for c in df.columns:
-        cl = c.lower()
-        if "branch" in cl or "филиал" in cl:
-            branch_col = c
-        elif "status" in cl or "статус" in cl:
-            status_col = c
-
-    if not branch_col or not status_col:
-        return pd.DataFrame(columns=["Филиал", "Всего", "Решено", "В работе", "Эффективность %"])
-
-    df[branch_col] = df[branch_col].fillna("Без филиала")
-    df[status_col] = df[status_col].fillna("")
-
-    # Группировка и подсчёт
-    grouped = df.groupby(branch_col)[status_col].apply(list).reset_index()
-
-    summary = []
-    for _, row in grouped.iterrows():
-        branch = row[branch_col]
-        statuses = [str(s).strip().lower() for s in row[status_col]]
-        total = len(statuses)
-        closed = sum(1 for s in statuses if "закрыт" in s or "решен" in s or "resolved" in s)
-        in_progress = total - closed
-        eff = round((closed / total) * 100, 1) if total > 0 else 0
-        summary.append({
-            "Филиал": branch,
-            "Всего": total,
-            "Решено": closed,
-            "В работе": in_progress,
-            "Эффективность %": eff
-        })
-
-    return pd.DataFrame(summary)
+def generate_summary(counts: pd.DataFrame):
+    """
+    Создаёт агрегированный отчёт по филиалам из дневных агрегатов
+    (DailyRollups.range: филиал × категория × статус × день).
+    """
+    columns = ["Филиал", "Всего", "Решено", "В работе", "Эффективность %", "Ср. время решения, ч"]
+    if counts.empty:
+        return pd.DataFrame(columns=columns)
+
+    branches = counts["Филиал"].astype(object).replace("", None).fillna("Без филиала")
+    statuses = counts["Статус"].astype(object).fillna("").astype(str).str.strip().str.lower()
+    is_closed = statuses.str.contains("закрыт|решен|resolved")
+
+    total = counts["n"].groupby(branches).sum()
+    closed = counts["n"].where(is_closed, 0).groupby(branches).sum()
+    resolved = counts["resolved"].groupby(branches).sum()
+    seconds = counts["resolve_seconds"].groupby(branches).sum()
+
+    summary = pd.DataFrame({
+        "Филиал": total.index,
+        "Всего": total.values,
+        "Решено": closed.reindex(total.index).values,
+    })
+    summary["В работе"] = summary["Всего"] - summary["Решено"]
+    summary["Эффективность %"] = (summary["Решено"] / summary["Всего"] * 100).round(1)
+    hours = (seconds / resolved.where(resolved > 0) / 3600).round(1)
+    summary["Ср. время решения, ч"] = hours.reindex(total.index).values
+    return summary[columns]
 
 
 # ============================
 # 📝 Текст отчёта для Telegram
 # ============================
-def build_text_report(df: pd.DataFrame, date_from: str, date_to: str) -> str:
+def build_text_report(counts: pd.DataFrame, date_from: str, date_to: str) -> str:
     """Создаёт короткий текст отчёта для Telegram."""
-    summary = generate_summary(df)
+    summary = generate_summary(counts)
     text = f"📅 Отчёт по жалобам ({date_from} — {date_to})\n\n"
 
     if summary.empty:
@@ -65,8 +51,11 @@ def build_text_report(df: pd.DataFrame, date_from: str, date_to: str) -> str:
         text += (
             f"🏫 {row['Филиал']}: {row['Всего']} жалоб | "
             f"✅ Решено: {row['Решено']} | ⏳ В работе: {row['В работе']} | "
-            f"📈 Эффективность: {row['Эффективность %']}%\n"
+            f"📈 Эффективность: {row['Эффективность %']}%"
         )
+        if pd.notna(row["Ср. время решения, ч"]):
+            text += f" | ⏱ Решение в среднем: {row['Ср. время решения, ч']} ч"
+        text += "\n"
 
     avg_eff = round(summary["Эффективность %"].mean(), 1)
     total = int(summary["Всего"].sum())
@@ -78,13 +67,10 @@ def build_text_report(df: pd.DataFrame, date_from: str, date_to: str) -> str:
 # ============================
 # 💾 Экспорт в Excel
 # ============================
-def export_to_excel(df: pd.DataFrame, filepath: str):
-    """Сохраняет отчёт в Excel."""
-    with pd.ExcelWriter(filepath, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Данные")
-        summary = generate_summary(df)
-        summary.to_excel(writer, index=False, sheet_name="Сводка")
-    return filepath
+def summary_rows(counts: pd.DataFrame) -> list:
+    """Лист «Сводка» для Excel: заголовки + строки по филиалам"""
+    summary = generate_summary(counts).astype(object)
+    return [list(summary.columns)] + summary.where(summary.notna(), None).values.tolist()
 
 
 # ============================
@@ -92,27 +78,19 @@ def export_to_excel(df: pd.DataFrame, filepath: str):
 # ============================
 async def send_reports(bot, date_from: str, date_to: str, chat_id: int):
     """Создаёт и отправляет отчёт за указанный период."""
-    cfg = bot.config
-    gs = GoogleSheetsClient(cfg["SERVICE_ACCOUNT_FILE"], cfg["GOOGLE_SHEET_ID"])
-
+    # агрегаты по дням (включая date_to целиком) — без чтения самих жалоб
     try:
-        df = gs.get_by_date_range(date_from, date_to)
+        counts = bot.rollups.range(date_from, date_to)
     except Exception as e:
         await bot.send_message(chat_id, f"⚠️ Ошибка при получении данных: {e}")
         return
 
-    text = build_text_report(df, date_from, date_to)
+    text = build_text_report(counts, date_from, date_to)
     await bot.send_message(chat_id, text)
 
-    # если есть данные — прикладываем Excel
-    if not df.empty:
-        fname = f"report_{date_from}_to_{date_to}.xlsx"
-        path = os.path.join(os.getcwd(), fname)
-        export_to_excel(df, path)
-        try:
-            await bot.send_document(chat_id, open(path, "rb"))
-        finally:
-            try:
-                os.remove(path)
-            except:
-                pass
+    # если есть данные — прикладываем Excel (собирается в отдельном процессе, без файлов на диске)
+    if not counts.empty:
+        data = await bot.exporter.export(date_from, date_to, summary=summary_rows(counts))
+        await bot.send_document(
+            chat_id, BufferedInputFile(data, filename=f"report_{date_from}_to_{date_to}.xlsx")
+        )
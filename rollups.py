@@ -0,0 +1,172 @@
+import sqlite3
+import threading
+import pandas as pd
+from metrics import metrics
+from stats_engine import CUBE_KEYS
+
+DAY_FORMAT = "%Y-%m-%d"
+ROLLUP_COLUMNS = CUBE_KEYS + ["n", "resolved", "resolve_seconds"]
+
+
+def _solved_at(row: str) -> str:
+    """julianday "Время решения" строки row (NEW/OLD) — форматы как в DATE_FORMATS, иначе NULL"""
+    value = f'trim({row}."Время решения")'
+    return (
+        f"julianday(CASE WHEN {value} LIKE '__.__.____ __:__' "
+        f"THEN substr({value}, 7, 4) || '-' || substr({value}, 4, 2) || '-' || substr({value}, 1, 2) "
+        f"|| ' ' || substr({value}, 12, 5) ELSE {value} END)"
+    )
+
+
+def _cell(row: str, sign: int) -> str:
+    """SELECT вклада одной жалобы (NEW/OLD) в её ячейку, со знаком"""
+    solved = _solved_at(row)
+    return (
+        f'SELECT substr({row}.date_ts, 1, 10), {row}."Филиал", {row}."Категория", {row}."Статус", '
+        f"{sign}, {sign} * ({solved} IS NOT NULL), "
+        f"{sign} * COALESCE(({solved} - julianday({row}.date_ts)) * 86400, 0) "
+        f"WHERE {row}.date_ts IS NOT NULL"
+    )
+
+
+def _apply(row: str, sign: int) -> str:
+    """Перенос вклада жалобы в daily_rollups (внутри триггера)"""
+    statement = (
+        "INSERT INTO daily_rollups (day, branch, category, status, n, resolved, resolve_seconds) "
+        f"{_cell(row, sign)} "
+        "ON CONFLICT(day, branch, category, status) DO UPDATE SET "
+        "n = n + excluded.n, resolved = resolved + excluded.resolved, "
+        "resolve_seconds = resolve_seconds + excluded.resolve_seconds;"
+    )
+    if sign < 0:
+        statement += f" DELETE FROM daily_rollups WHERE day = substr({row}.date_ts, 1, 10) AND n <= 0;"
+    return statement
+
+
+# поля жалобы, от которых зависит её ячейка и время решения
+ROLLUP_FIELDS = ["date_ts", '"Филиал"', '"Категория"', '"Статус"', '"Время решения"']
+
+TRIGGERS = {
+    "daily_rollups_insert": f"AFTER INSERT ON complaints BEGIN {_apply('NEW', 1)} END",
+    "daily_rollups_delete": f"AFTER DELETE ON complaints BEGIN {_apply('OLD', -1)} END",
+    "daily_rollups_update": (
+        f"AFTER UPDATE OF {', '.join(ROLLUP_FIELDS)} ON complaints "
+        f"WHEN {' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in ROLLUP_FIELDS)} "
+        f"BEGIN {_apply('OLD', -1)} {_apply('NEW', 1)} END"
+    ),
+}
+
+
+# ============================
+# 📆 Дневные агрегаты для отчётов
+# ============================
+class DailyRollups:
+    """
+    Количество жалоб по дням × филиал × категория × статус и суммарное
+    время решения — в таблице daily_rollups той же базы. Таблицу ведут
+    триггеры на complaints: агрегат меняется в той же транзакции, что и
+    жалоба, поэтому не расходится с ней ни при ошибках, ни при записи
+    из других воркеров (и из импорта). Из истории таблица заполняется
+    один раз — вместе с установкой триггеров. Отчёт за неделю или месяц
+    читает десятки строк агрегатов, а не все жалобы.
+
+    daily_rollups:
+      day             — день жалобы (по date_ts), YYYY-MM-DD
+      branch / category / status
+      n               — число жалоб
+      resolved        — из них с заполненным "Время решения"
+      resolve_seconds — сумма (Время решения − Дата) по решённым
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._install()
+
+    # ------------------------------
+    # 📥 Триггеры и заполнение из истории
+    # ------------------------------
+    def _install(self):
+        """Таблица и триггеры; если триггеров ещё не было — пересчёт из истории в той же транзакции"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS daily_rollups (
+                        day TEXT NOT NULL,
+                        branch TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        n INTEGER NOT NULL DEFAULT 0,
+                        resolved INTEGER NOT NULL DEFAULT 0,
+                        resolve_seconds REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, branch, category, status)
+                    )
+                """)
+                existing = {
+                    name for (name,) in self._conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'complaints'"
+                    )
+                }
+                missing = [name for name in TRIGGERS if name not in existing]
+                for name in missing:
+                    self._conn.execute(f"CREATE TRIGGER {name} {TRIGGERS[name]}")
+                if missing:
+                    self._backfill()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _backfill(self):
+        self._conn.execute("DELETE FROM daily_rollups")
+        solved = _solved_at("complaints")
+        self._conn.execute(f"""
+            INSERT INTO daily_rollups (day, branch, category, status, n, resolved, resolve_seconds)
+            SELECT substr(date_ts, 1, 10), "Филиал", "Категория", "Статус", COUNT(*),
+                   SUM({solved} IS NOT NULL),
+                   SUM(COALESCE(({solved} - julianday(date_ts)) * 86400, 0))
+            FROM complaints
+            WHERE date_ts IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        """)
+        cells = self._conn.execute("SELECT COUNT(*) FROM daily_rollups").fetchone()[0]
+        metrics.set("rollup_cells", cells)
+        print(f"📆 Дневные агрегаты пересчитаны: {cells} ячеек")
+
+    def backfill(self):
+        """Полный пересчёт агрегатов из complaints (вручную, например после правок базы)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._backfill()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # ------------------------------
+    # 📊 Чтение для отчётов
+    # ------------------------------
+    def range(self, date_from: str, date_to: str) -> pd.DataFrame:
+        """
+        Агрегаты за дни с date_from по date_to включительно —
+        колонки как у StatsCube.counts (+ resolved, resolve_seconds).
+        """
+        start = pd.to_datetime(date_from).strftime(DAY_FORMAT)
+        end = pd.to_datetime(date_to).strftime(DAY_FORMAT)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT branch, category, status, day, n, resolved, resolve_seconds "
+                "FROM daily_rollups WHERE day >= ? AND day <= ? ORDER BY day",
+                (start, end),
+            ).fetchall()
+        counts = pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+        counts["День"] = pd.to_datetime(counts["День"], format=DAY_FORMAT)
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,98 +1,55 @@
 import asyncio
 from datetime import datetime, timedelta, time
-from google_sheets import GoogleSheetsClient
 from reports import send_reports
 import traceback
 
+# сколько помнить, что отчёт за период уже отправлен
+REPORT_DEDUP_TTL = 40 * 86400
+
 # ================================
 # 🚀 Запуск планировщика
 # ================================
 def start_scheduler(bot):
     """
     Запускает фоновые задачи:
-      - check_pending_calls (каждые 10 минут)
+      - sla_reminders (ровно в срок, SLA_CALL_HOURS после создания жалобы)
       - weekly_report (каждый понедельник в 09:00)
       - monthly_report (каждое 1-е число в 09:00)
     """
-    asyncio.create_task(_run_check_pending_calls_periodically(bot))
+    asyncio.create_task(_run_sla_reminders(bot))
     asyncio.create_task(_run_weekly_report_task(bot))
     asyncio.create_task(_run_monthly_report_task(bot))
     print("🕒 Планировщик запущен.")
 
 
 # ------------------------------
-# 🔔 Проверка необзвоненных жалоб
+# 🔔 Напоминания о необзвоненных жалобах
 # ------------------------------
-async def _run_check_pending_calls_periodically(bot):
+async def _run_sla_reminders(bot):
     """
-    Каждые 10 минут проверяет жалобы со статусом 'Ожидает обзвона'
-    старше 2 часов. Отправляет напоминание только один раз.
+    Напоминает в группу жалоб, если жалоба ждёт обзвона дольше SLA_CALL_HOURS.
+    Сроки ставятся при создании жалобы и снимаются при смене статуса
+    (bot.sla), задача спит ровно до ближайшего срока. Напоминание —
+    один раз на жалобу, отметка хранится в базе.
     """
-    cfg = bot.config
-    group_complaints = cfg["GROUP_COMPLAINTS_ID"]
-
-    notified_ids = set()
-
-    while True:
-        try:
-            gs = GoogleSheetsClient(cfg["SERVICE_ACCOUNT_FILE"], cfg["GOOGLE_SHEET_ID"])
-            df = gs.get_all_data()
-            if df is None or df.empty:
-                await asyncio.sleep(600)
-                continue
-
-            # Поиск нужных колонок
-            status_col = next((c for c in df.columns if "статус" in c.lower()), None)
-            date_col = next((c for c in df.columns if "дата" in c.lower()), None)
-            id_col = next((c for c in df.columns if c.lower() == "id"), None)
-
-            if not all([status_col, date_col, id_col]):
-                print("⚠️ В таблице не найдены нужные колонки (ID / Статус / Дата).")
-                await asyncio.sleep(600)
-                continue
-
-            now = datetime.now()
-            for _, row in df.iterrows():
-                try:
-                    status = str(row.get(status_col, "")).strip().lower()
-                    if status not in ("ожидает обзвона", "ожидает", "awaiting call", "new"):
-                        continue
-
-                    raw_date = str(row.get(date_col, ""))
-                    parsed = None
-                    for fmt in ("%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-                        try:
-                            parsed = datetime.strptime(raw_date, fmt)
-                            break
-                        except Exception:
-                            continue
-                    if not parsed:
-                        continue
-
-                    diff = now - parsed
-                    cid = str(row.get(id_col, "")).strip()
-
-                    # Пропускаем старые (более 3 дней) и уже уведомлённые
-                    if diff.days > 3 or cid in notified_ids:
-                        continue
-
-                    if diff.total_seconds() > 2 * 3600:
-                        text = (
-                            f"🔔 Напоминание:\n"
-                            f"Жалоба <b>{cid}</b> ожидает обзвона более 2 часов.\n"
-                            f"🕓 Создана: {parsed.strftime('%d.%m.%Y %H:%M')}"
-                        )
-                        await bot.send_message(group_complaints, text)
-                        notified_ids.add(cid)
-                        print(f"📢 Напоминание отправлено для {cid}")
-
-                except Exception:
-                    traceback.print_exc()
-
-        except Exception:
-            traceback.print_exc()
-
-        await asyncio.sleep(600)  # 10 минут
+    group_complaints = bot.config["GROUP_COMPLAINTS_ID"]
+    hours = bot.config.get("SLA_CALL_HOURS", 2)
+
+    async def remind(cid, created):
+        created_text = created.strftime('%d.%m.%Y %H:%M') if created else "—"
+        text = (
+            f"🔔 Напоминание:\n"
+            f"Жалоба <b>{cid}</b> ожидает обзвона более {hours} часов.\n"
+            f"🕓 Создана: {created_text}"
+        )
+        await bot.send_message(group_complaints, text)
+        print(f"📢 Напоминание отправлено для {cid}")
+
+    try:
+        bot.sla.rebuild(bot.sla.loader())
+    except Exception:
+        traceback.print_exc()
+    await bot.sla.run(remind)
 
 
 # ------------------------------
@@ -119,6 +76,9 @@ async def _run_weekly_report_task(bot):
 
             date_to = (next_monday - timedelta(days=1)).date()
             date_from = date_to - timedelta(days=6)
+            # при нескольких воркерах отчёт отправляет тот, кто успел первым
+            if not bot.shared.add_if_absent("reports", f"weekly:{date_to}", ttl=REPORT_DEDUP_TTL):
+                continue
             await send_reports(bot, str(date_from), str(date_to), leaders)
             print(f"✅ Еженедельный отчёт отправлен: {date_from}–{date_to}")
 
@@ -153,6 +113,8 @@ async def _run_monthly_report_task(bot):
             # предыдущий месяц
             last_day_prev = (next_month - timedelta(days=1)).date()
             first_day_prev = last_day_prev.replace(day=1)
+            if not bot.shared.add_if_absent("reports", f"monthly:{first_day_prev}", ttl=REPORT_DEDUP_TTL):
+                continue
             await send_reports(bot, str(first_day_prev), str(last_day_prev), leaders)
             print(f"✅ Месячный отчёт отправлен: {first_day_prev}–{last_day_prev}")
 
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from metrics import metrics
+
+# методы, которые пишут в чат: общий лимит бота и обработка retry_after
+THROTTLED_PREFIXES = ("send", "edit", "delete", "copy", "forward", "pin", "unpin")
+# из них новые сообщения — ещё и лимит на чат (правки и удаления по кнопкам не ждут рассылок)
+CHAT_LIMITED_PREFIXES = ("send", "copy", "forward")
+
+# полосы: ответы пользователям (личные чаты) идут раньше рассылок в группы
+LANE_PRIVATE = 0
+LANE_GROUP = 1
+LANE_NAMES = {LANE_PRIVATE: "private", LANE_GROUP: "group"}
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # до этого момента чат заблокирован Telegram (retry_after)
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Забирает токен (в долг, если нет) — через сколько секунд можно отправлять"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        # после блокировки начинаем с пустого ведра
+        self.tokens = min(self.tokens, 0.0)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+# ============================
+# 📮 Очередь исходящих запросов
+# ============================
+class OutboundQueue(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram: все send/edit/delete проходят через неё.
+
+    - новые сообщения (send*/copy/forward): у каждого чата своё ведро
+      токенов (личный чат ~1/с, группа ~20/мин) и свой замок — сообщения
+      в чат уходят строго по очереди; правки и удаления сообщений этот
+      лимит не ждут;
+    - общий лимит бота (~30/с) раздаётся по приоритету: личные чаты
+      раньше групп;
+    - TelegramRetryAfter блокирует чат на retry_after секунд, запрос
+      повторяется (до max_retries раз) — хендлер ошибку не видит.
+
+    Метрики: send_queue_wait_seconds_<полоса>, send_queue_waiting,
+    send_retry_after, send_queue_requests.
+    """
+
+    # сколько ведер держать, прежде чем выбрасывать простаивающие
+    PRUNE_ABOVE = 1000
+
+    def __init__(self, private_rate: float = 1.0, group_rate: float = 20 / 60,
+                 global_rate: float = 30.0, private_burst: float = 3.0, group_burst: float = 3.0,
+                 max_retries: int = 3):
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, burst=global_rate)
+        self._buckets = {}
+        self._locks = {}
+        # ожидающие общего лимита: (полоса, порядковый номер, future)
+        self._waiters = []
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    @staticmethod
+    def _lane(chat_id) -> int:
+        # у групп и каналов id отрицательный, у каналов бывает "@username"
+        return LANE_PRIVATE if isinstance(chat_id, int) and chat_id > 0 else LANE_GROUP
+
+    def _bucket(self, chat_id, lane: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > self.PRUNE_ABOVE:
+                self._prune()
+            bucket = (
+                TokenBucket(self.private_rate, burst=self.private_burst)
+                if lane == LANE_PRIVATE
+                else TokenBucket(self.group_rate, burst=self.group_burst)
+            )
+            self._buckets[chat_id] = bucket
+            self._locks[chat_id] = asyncio.Lock()
+        return bucket
+
+    def _prune(self):
+        for chat_id in [c for c, b in self._buckets.items() if b.idle() and not self._locks[c].locked()]:
+            del self._buckets[chat_id]
+            del self._locks[chat_id]
+
+    # ------------------------------
+    # 🎟 Общий лимит с приоритетом
+    # ------------------------------
+    async def _global_slot(self, lane: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._order), future))
+        metrics.set("send_queue_waiting", len(self._waiters))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Выдаёт токены общего лимита ожидающим — по полосе, затем по порядку"""
+        while True:
+            while not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            wait = self._global.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            metrics.set("send_queue_waiting", len(self._waiters))
+
+    # ------------------------------
+    # 📤 Middleware
+    # ------------------------------
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        name = method.__api_method__
+        if chat_id is None or not name.startswith(THROTTLED_PREFIXES):
+            return await make_request(bot, method)
+
+        lane = self._lane(chat_id)
+        per_chat = name.startswith(CHAT_LIMITED_PREFIXES)
+        if per_chat:
+            bucket = self._bucket(chat_id, lane)
+            lock = self._locks[chat_id]
+        else:
+            # правка/удаление: только общий лимит, но блокировку чата (retry_after) уважаем
+            bucket = self._buckets.get(chat_id)
+            lock = contextlib.nullcontext()
+        enqueued = time.monotonic()
+        metrics.inc("send_queue_requests")
+        async with lock:
+            for attempt in range(self.max_retries + 1):
+                if bucket is not None:
+                    wait = bucket.reserve() if per_chat else bucket.blocked_until - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                await self._global_slot(lane)
+                if attempt == 0:
+                    metrics.observe(f"send_queue_wait_seconds_{LANE_NAMES[lane]}", time.monotonic() - enqueued)
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    metrics.inc("send_retry_after")
+                    print(f"⏳ Лимит Telegram для чата {chat_id}: ждём {e.retry_after} с")
+                    if bucket is None:
+                        bucket = self._bucket(chat_id, lane)
+                    bucket.block(e.retry_after)
+                    if attempt == self.max_retries:
+                        raise
@@ -0,0 +1,118 @@
+import os
+import socket
+import uuid
+from abc import ABC, abstractmethod
+
+# кто держит блокировку: уникально для процесса
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ============================
+# 🤝 Общее состояние воркеров
+# ============================
+class SharedState(ABC):
+    """
+    Состояние, общее для всех воркеров бота: блокировки с арендой,
+    атомарная дедупликация, словари (message_id и т.п.) и счётчики.
+    Реализации: StateStore (SQLite — воркеры на одной машине/одном диске).
+    Для нескольких машин — реализация поверх Redis с теми же методами.
+    """
+
+    @abstractmethod
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт (или продлевает своей же) блокировку на ttl секунд"""
+
+    @abstractmethod
+    def release(self, name: str, owner: str):
+        """Снимает блокировку, если её держит owner"""
+
+    @abstractmethod
+    def add_if_absent(self, ns: str, key, ttl: float, value=1) -> bool:
+        """Атомарно добавляет ключ; False — ключ уже есть (кто-то успел раньше)"""
+
+    @abstractmethod
+    def get(self, ns: str, key, default=None):
+        """Значение ключа (или default, если нет / истёк)"""
+
+    @abstractmethod
+    def put(self, ns: str, key, value, ttl: float):
+        """Записывает значение на ttl секунд"""
+
+    @abstractmethod
+    def delete(self, ns: str, key):
+        """Удаляет ключ"""
+
+    @abstractmethod
+    def incr(self, name: str, floor: int = 0) -> int:
+        """Атомарный счётчик: max(текущее, floor) + 1"""
+
+    def close(self):
+        pass
+
+
+def open_shared_state(url: str) -> SharedState:
+    """
+    SHARED_STATE_URL → бэкенд общего состояния.
+    sqlite:///path/to/file.db — SQLite (по умолчанию — база жалоб).
+    """
+    if url.startswith("sqlite:///"):
+        from state_store import StateStore
+        return StateStore(url[len("sqlite:///"):])
+    raise ValueError(f"Неизвестный бэкенд общего состояния: {url}")
+
+
+# ============================
+# 🔒 Блокировки по ключу
+# ============================
+class LockManager:
+    """
+    Блокировка «один обработчик на ключ» через SharedState — работает
+    между воркерами. Аренда ttl защищает от вечной блокировки, если
+    воркер упал, не отпустив её.
+
+    Каждый захват получает свой токен (owner:uuid), поэтому повторный
+    acquire того же ключа в том же процессе тоже отклоняется.
+    """
+
+    def __init__(self, shared: SharedState, owner: str = WORKER_ID, ttl: float = 60.0):
+        self.shared = shared
+        self.owner = owner
+        self.ttl = ttl
+        # ключ → токен захвата, которым он удерживается
+        self._tokens = {}
+
+    async def acquire(self, key) -> bool:
+        token = f"{self.owner}:{uuid.uuid4().hex}"
+        if not self.shared.acquire(f"lock:{key}", token, self.ttl):
+            return False
+        self._tokens[key] = token
+        return True
+
+    def release(self, key):
+        token = self._tokens.pop(key, None)
+        if token is not None:
+            self.shared.release(f"lock:{key}", token)
+
+
+class Lease:
+    """Роль, которую выполняет один воркер (например, отправка в Google Sheets)"""
+
+    def __init__(self, shared: SharedState, name: str, ttl: float, owner: str = WORKER_ID):
+        self.shared = shared
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner
+        self.held = False
+
+    def __call__(self) -> bool:
+        """Берёт или продлевает аренду; True — эта роль сейчас наша"""
+        held = self.shared.acquire(f"lease:{self.name}", self.owner, self.ttl)
+        if held != self.held:
+            print(f"{'👑 Воркер получил' if held else '↪️ Воркер отдал'} роль {self.name}")
+        self.held = held
+        return held
+
+    def release(self):
+        if self.held:
+            self.shared.release(f"lease:{self.name}", self.owner)
+            self.held = False
@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from complaint_store import parse_date, parse_dates
+from handlers.complaints import uz_time
+from metrics import metrics
+
+PENDING_STATUSES = ("ожидает обзвона", "ожидает", "awaiting call", "new")
+CREATED_FORMAT = "%Y-%m-%d %H:%M:%S"
+# "Дата" жалобы пишется по Ташкенту (uz_time), независимо от часового пояса сервера
+UZ_TZ = timezone(timedelta(hours=5))
+
+
+def is_pending(status) -> bool:
+    return str(status or "").strip().lower() in PENDING_STATUSES
+
+
+def find_overdue_calls(df: pd.DataFrame, now: datetime, status_col: str, date_col: str,
+                       id_col: str, after=timedelta(hours=2), max_days: int = 3) -> pd.Series:
+    """
+    Жалобы, которые ждут обзвона дольше after, но не старше max_days дней.
+    Статус и возраст проверяются векторно по всей таблице, наружу — только
+    кандидаты: Series {ID: дата создания}.
+    """
+    status = df[status_col]
+    if isinstance(status.dtype, pd.CategoricalDtype):
+        # нормализуем только уникальные значения, а не каждую строку
+        pending = [c for c in status.cat.categories if is_pending(c)]
+        pending_mask = status.isin(pending)
+    else:
+        pending_mask = status.astype(str).str.strip().str.lower().isin(PENDING_STATUSES)
+
+    created = df[date_col]
+    if not pd.api.types.is_datetime64_any_dtype(created):
+        created = parse_dates(created)
+
+    age = pd.Timestamp(now) - created
+    mask = pending_mask & (age > after) & (age.dt.days <= max_days)
+
+    candidates = df.loc[mask]
+    return pd.Series(
+        created[mask].to_numpy(),
+        index=candidates[id_col].astype(str).str.strip(),
+    )
+
+
+# ============================
+# ⏰ Таймеры напоминаний об обзвоне
+# ============================
+class SlaTimers:
+    """
+    Очередь сроков «жалоба ждёт обзвона дольше delay».
+    Новая жалоба со статусом 'Ожидает обзвона' ставит срок, смена статуса
+    снимает его (подписка на store). После импорта из таблицы сроки
+    пересобираются по loader() — как у StatsCounters. Фоновая задача спит
+    ровно до ближайшего срока. Сроки хранятся в таблице sla_deadlines той
+    же базы и восстанавливаются при запуске.
+
+    sla_deadlines:
+      id      — ID жалобы
+      due     — срок напоминания (unix time)
+      created — дата жалобы (для текста напоминания)
+      fired   — 1, если напоминание уже отправлено
+    """
+
+    def __init__(self, path: str, loader, delay=timedelta(hours=2), max_days: int = 3):
+        # loader() → DataFrame всех жалоб (для пересборки после импорта)
+        self.loader = loader
+        self.delay = delay
+        # после долгого простоя не напоминаем о жалобах старше max_days дней
+        self.max_days = max_days
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sla_deadlines (
+                id TEXT PRIMARY KEY,
+                due REAL NOT NULL,
+                created TEXT NOT NULL,
+                fired INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # куча (due, id); отменённые/перенесённые записи отбрасываются при извлечении
+        self._heap = []
+        self._due = {}
+        self._wakeup = asyncio.Event()
+
+    # ------------------------------
+    # 📥 Восстановление при запуске
+    # ------------------------------
+    def rebuild(self, df: pd.DataFrame):
+        """
+        Загружает сохранённые сроки и добавляет недостающие для жалоб,
+        которые ждут обзвона (например, созданных до появления таймеров).
+        """
+        with self._lock:
+            cutoff = time.time() - (self.max_days + 1) * 86400
+            self._conn.execute("DELETE FROM sla_deadlines WHERE fired = 1 AND due < ?", (cutoff,))
+
+            if df is not None and not df.empty:
+                # все ожидающие в окне max_days, включая ещё не просроченные
+                pending = find_overdue_calls(
+                    df, uz_time(), "Статус", "Дата", "ID",
+                    after=-self.delay, max_days=self.max_days,
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO sla_deadlines (id, due, created) VALUES (?, ?, ?)",
+                    [
+                        (cid, self._deadline(created), created.strftime(CREATED_FORMAT))
+                        for cid, created in pending.items()
+                    ],
+                )
+
+            self._heap = []
+            self._due = {}
+            for cid, due in self._conn.execute("SELECT id, due FROM sla_deadlines WHERE fired = 0"):
+                self._due[cid] = due
+                self._heap.append((due, cid))
+            heapq.heapify(self._heap)
+        metrics.set("sla_pending", len(self._due))
+        self._wakeup.set()
+        print(f"⏰ Таймеры напоминаний восстановлены: {len(self._due)}")
+
+    # ------------------------------
+    # 🔔 Подписка на изменения жалоб
+    # ------------------------------
+    def on_change(self, before: dict | None, after: dict | None):
+        if after is None:
+            # данные перезагружены целиком (импорт из Google Sheets)
+            self.rebuild(self.loader())
+            return
+        cid = str(after.get("ID", "")).strip()
+        if is_pending(after.get("Статус")):
+            if before is None or not is_pending(before.get("Статус")):
+                created = parse_date(after.get("Дата")) or uz_time()
+                self.schedule(cid, created)
+        elif cid in self._due or before is None or is_pending(before.get("Статус")):
+            # срок мог поставить другой воркер — снимаем общую запись в базе, а не только свою
+            self.cancel(cid)
+
+    def _deadline(self, created: datetime) -> float:
+        """Срок напоминания (unix time) для даты жалобы по Ташкенту"""
+        return (created + self.delay).replace(tzinfo=UZ_TZ).timestamp()
+
+    def schedule(self, cid: str, created: datetime):
+        due = self._deadline(created)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sla_deadlines (id, due, created, fired) VALUES (?, ?, ?, 0)",
+                (cid, due, created.strftime(CREATED_FORMAT)),
+            )
+            self._due[cid] = due
+            heapq.heappush(self._heap, (due, cid))
+        metrics.set("sla_pending", len(self._due))
+        # новый срок может оказаться раньше того, до которого спит run()
+        self._wakeup.set()
+
+    def cancel(self, cid: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sla_deadlines WHERE id = ? AND fired = 0", (cid,))
+            self._due.pop(cid, None)
+        metrics.set("sla_pending", len(self._due))
+
+    def _pop_due(self, now: float) -> list:
+        """Снимает с кучи все наступившие сроки"""
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, cid = heapq.heappop(self._heap)
+                if self._due.get(cid) != due:
+                    continue  # отменён или перенесён
+                del self._due[cid]
+                row = self._conn.execute(
+                    "SELECT created FROM sla_deadlines WHERE id = ? AND fired = 0", (cid,)
+                ).fetchone()
+                if row is None:
+                    continue  # снят другим воркером
+                claimed = self._conn.execute(
+                    "UPDATE sla_deadlines SET fired = 1 WHERE id = ? AND fired = 0", (cid,)
+                ).rowcount
+                if claimed:
+                    # напоминание отправляет только тот воркер, который отметил срок
+                    ready.append((cid, row[0]))
+        metrics.set("sla_pending", len(self._due))
+        return ready
+
+    def _next_due(self) -> float | None:
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    # ------------------------------
+    # 💤 Ожидание ближайшего срока
+    # ------------------------------
+    async def run(self, on_due):
+        """on_due(cid, created) — async-функция, вызывается один раз на жалобу"""
+        while True:
+            self._wakeup.clear()
+            next_due = self._next_due()
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.time()
+            for cid, created in self._pop_due(now):
+                created_at = parse_date(created)
+                if created_at and (uz_time() - created_at).days > self.max_days:
+                    continue
+                try:
+                    await on_due(cid, created_at)
+                    metrics.inc("sla_reminders_sent")
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,336 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from metrics import metrics
+from shared_state import SharedState
+
+# «без срока» для счётчиков
+FOREVER = 1e18
+
+
+# ============================
+# 💾 Служебное состояние бота в SQLite
+# ============================
+class StateStore(SharedState):
+    """
+    Небольшое key-value хранилище для состояния, которое должно переживать
+    перезапуск: защита от повторных нажатий, message_id сообщений для
+    редактирования. Записи живут ttl секунд, потом удаляются.
+    Это же SQLite-реализация SharedState: все операции атомарны между
+    процессами, работающими с одним файлом базы.
+
+    kv:
+      ns      — пространство имён (одно на коллекцию)
+      key     — ключ (JSON, чтобы int и str не путались)
+      value   — значение (JSON)
+      expires — unix time, после которого запись не нужна
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS kv (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires REAL NOT NULL,
+                PRIMARY KEY (ns, key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv(expires)")
+
+    def map(self, ns: str, ttl: float, cap: int = 10000, shared: bool = False) -> "PersistentMap":
+        return PersistentMap(self, ns, ttl, cap, shared)
+
+    def set(self, ns: str, ttl: float, cap: int = 10000, shared: bool = False) -> "PersistentSet":
+        return PersistentSet(self, ns, ttl, cap, shared)
+
+    def _load(self, ns: str, limit: int) -> dict:
+        """Самые свежие limit записей (старые первыми — для порядка LRU)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE ns = ? AND expires < ?", (ns, time.time()))
+            rows = self._conn.execute(
+                "SELECT key, value, expires FROM kv WHERE ns = ? ORDER BY expires DESC LIMIT ?",
+                (ns, limit),
+            ).fetchall()
+        return {json.loads(k): (json.loads(v), exp) for k, v, exp in reversed(rows)}
+
+    def _get(self, ns: str, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM kv WHERE ns = ? AND key = ? AND expires >= ?",
+                (ns, json.dumps(key), time.time()),
+            ).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def _put(self, ns: str, key, value, expires: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                (ns, json.dumps(key), json.dumps(value, ensure_ascii=False), expires),
+            )
+
+    def _delete(self, ns: str, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, json.dumps(key)))
+
+    def _purge(self, ns: str, now: float):
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM kv WHERE ns = ? AND expires < ?", (ns, now)
+            ).rowcount
+
+    # ------------------------------
+    # SharedState
+    # ------------------------------
+    def _claim(self, ns: str, key, value, ttl: float, reentrant: bool) -> bool:
+        """INSERT, а если ключ есть — UPDATE только истёкшего (или своего) ключа"""
+        now = time.time()
+        condition = "kv.expires < ?" + (" OR kv.value = excluded.value" if reentrant else "")
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT(ns, key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                f"WHERE {condition}",
+                (ns, json.dumps(key), json.dumps(value, ensure_ascii=False), now + ttl, now),
+            )
+        return cur.rowcount == 1
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return self._claim("locks", name, owner, ttl, reentrant=True)
+
+    def release(self, name: str, owner: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM kv WHERE ns = 'locks' AND key = ? AND value = ?",
+                (json.dumps(name), json.dumps(owner)),
+            )
+
+    def add_if_absent(self, ns: str, key, ttl: float, value=1) -> bool:
+        return self._claim(ns, key, value, ttl, reentrant=False)
+
+    def get(self, ns: str, key, default=None):
+        row = self._get(ns, key)
+        return default if row is None else row[0]
+
+    def put(self, ns: str, key, value, ttl: float):
+        self._put(ns, key, value, time.time() + ttl)
+
+    def delete(self, ns: str, key):
+        self._delete(ns, key)
+
+    def incr(self, name: str, floor: int = 0) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM kv WHERE ns = 'counters' AND key = ?", (json.dumps(name),)
+                ).fetchone()
+                value = max(json.loads(row[0]) if row else 0, floor) + 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (ns, key, value, expires) VALUES ('counters', ?, ?, ?)",
+                    (json.dumps(name), json.dumps(value), FOREVER),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BoundedMap:
+    """
+    dict в памяти с ограничением по размеру (LRU) и сроку жизни записей.
+    При переполнении выбрасывается давно не использованная запись,
+    просроченные удаляются при обращении. Метрики: state_<name>_size,
+    state_<name>_evicted, state_<name>_expired.
+    """
+
+    def __init__(self, name: str, cap: int = 10000, ttl: float | None = None):
+        self.name = name
+        self.cap = cap
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def put(self, key, value, expires: float | None = None):
+        """Запись с явным сроком (для загрузки из базы)"""
+        self._items[key] = (value, expires)
+        self._items.move_to_end(key)
+        while len(self._items) > self.cap:
+            self._items.popitem(last=False)
+            metrics.inc(f"state_{self.name}_evicted")
+        # самые старые записи — в начале: просроченные снимаем заодно
+        now = time.time()
+        while self._items:
+            oldest, (_, exp) = next(iter(self._items.items()))
+            if exp is None or exp >= now:
+                break
+            del self._items[oldest]
+            metrics.inc(f"state_{self.name}_expired")
+        metrics.set(f"state_{self.name}_size", len(self._items))
+
+    def _alive(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.time():
+            del self._items[key]
+            metrics.inc(f"state_{self.name}_expired")
+            return None
+        self._items.move_to_end(key)
+        return item
+
+    def get(self, key, default=None):
+        item = self._alive(key)
+        return default if item is None else item[0]
+
+    def __getitem__(self, key):
+        item = self._alive(key)
+        if item is None:
+            raise KeyError(key)
+        return item[0]
+
+    def __contains__(self, key) -> bool:
+        return self._alive(key) is not None
+
+    def __setitem__(self, key, value):
+        self.put(key, value, time.time() + self.ttl if self.ttl else None)
+
+    def __delitem__(self, key):
+        del self._items[key]
+        metrics.set(f"state_{self.name}_size", len(self._items))
+
+    def pop(self, key, default=None):
+        item = self._alive(key)
+        if item is None:
+            return default
+        del self[key]
+        return item[0]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PersistentMap:
+    """
+    dict-подобная коллекция с записью в StateStore.
+    В памяти держится не больше cap последних записей (BoundedMap),
+    остальные читаются из базы по ключу при обращении.
+    shared=True — несколько воркеров: значения всегда читаются из базы.
+    """
+
+    # как часто (в записях) выбрасывать просроченные из базы
+    PURGE_EVERY = 500
+
+    def __init__(self, store: StateStore, ns: str, ttl: float, cap: int = 10000, shared: bool = False):
+        self._store = store
+        self.ns = ns
+        self.ttl = ttl
+        self.shared = shared
+        self._cache = BoundedMap(ns, cap=cap, ttl=ttl)
+        self._loaded = False
+        self._writes = 0
+
+    def _ensure_loaded(self):
+        if self._loaded or self.shared:
+            return
+        for key, (value, expires) in self._store._load(self.ns, self._cache.cap).items():
+            self._cache.put(key, value, expires)
+        self._loaded = True
+
+    def _lookup(self, key):
+        self._ensure_loaded()
+        if not self.shared and key in self._cache:
+            return True, self._cache[key]
+        row = self._store._get(self.ns, key)
+        if row is None:
+            return False, None
+        value, expires = row
+        if not self.shared:
+            self._cache.put(key, value, expires)
+        return True, value
+
+    def get(self, key, default=None):
+        found, value = self._lookup(key)
+        return value if found else default
+
+    def __getitem__(self, key):
+        found, value = self._lookup(key)
+        if not found:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self._lookup(key)[0]
+
+    def __setitem__(self, key, value):
+        self._ensure_loaded()
+        expires = time.time() + self.ttl
+        if not self.shared:
+            self._cache.put(key, value, expires)
+        self._store._put(self.ns, key, value, expires)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def add_if_absent(self, key, value=1) -> bool:
+        """Атомарно (между воркерами) добавляет ключ; False — уже был"""
+        if not self.shared and key in self._cache:
+            return False
+        if not self._store.add_if_absent(self.ns, key, self.ttl, value):
+            return False
+        if not self.shared:
+            self._cache[key] = value
+        return True
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        found, value = self._lookup(key)
+        if not found:
+            return default
+        self._cache.pop(key)
+        self._store._delete(self.ns, key)
+        return value
+
+    def purge(self):
+        """Удаляет просроченные записи из базы"""
+        removed = self._store._purge(self.ns, time.time())
+        if removed:
+            metrics.inc(f"state_{self.ns}_expired", removed)
+
+
+_MISSING = object()
+
+
+class PersistentSet:
+    """Множество поверх PersistentMap (для защиты от повторных нажатий)"""
+
+    def __init__(self, store: StateStore, ns: str, ttl: float, cap: int = 10000, shared: bool = False):
+        self._map = PersistentMap(store, ns, ttl, cap, shared)
+
+    def add(self, key):
+        self._map[key] = 1
+
+    def add_if_absent(self, key) -> bool:
+        return self._map.add_if_absent(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._map
+
+    def remove(self, key):
+        del self._map[key]
+
+    def discard(self, key):
+        self._map.pop(key)
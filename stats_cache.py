@@ -0,0 +1,31 @@
+import time
+from metrics import metrics
+
+
+# ============================
+# 🗃 Кэш данных для статистики
+# ============================
+class StatsCache:
+    """
+    Снимок данных для меню статистики.
+    Загружается не чаще раза в ttl секунд и сбрасывается при любом
+    изменении жалобы, поэтому просмотр всех разделов подряд стоит одну загрузку.
+    """
+
+    def __init__(self, loader, ttl: float = 60.0):
+        self.loader = loader
+        self.ttl = ttl
+        self._snapshot = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        if self._snapshot is None or time.monotonic() - self._loaded_at > self.ttl:
+            metrics.inc("stats_cache_misses")
+            self._snapshot = self.loader()
+            self._loaded_at = time.monotonic()
+        else:
+            metrics.inc("stats_cache_hits")
+        return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
@@ -0,0 +1,178 @@
+from collections import Counter
+import pandas as pd
+from complaint_store import parse_date
+
+# статусы жалобы по порядку жизненного цикла
+STATUS_WAITING = "Ожидает обзвона"
+STATUS_CALLED = "Принята"
+STATUS_SOLUTION = "Ожидает уведомления"
+STATUS_CLOSED = "Закрыта"
+
+STATUS_FIELDS = {
+    "waiting": STATUS_WAITING,
+    "called": STATUS_CALLED,
+    "solution": STATUS_SOLUTION,
+    "notified": STATUS_CLOSED,
+}
+
+SUMMARY_COLUMNS = ["total"] + list(STATUS_FIELDS)
+CUBE_KEYS = ["Филиал", "Категория", "Статус", "День"]
+
+
+# ============================
+# 🧮 Куб статистики
+# ============================
+class StatsCube:
+    """
+    Количество жалоб по осям филиал × категория × статус × день,
+    посчитанное одним groupby. Все разделы статистики и отчёты
+    берут цифры из этого (маленького) куба, а не из исходных строк.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        # исходные строки — только для выгрузки в Excel
+        self.df = df
+        if df.empty:
+            self.counts = pd.DataFrame(columns=CUBE_KEYS + ["n"])
+            return
+
+        day = df["Дата"].dt.normalize().rename("День")
+        self.counts = (
+            df.groupby([df["Филиал"], df["Категория"], df["Статус"], day], observed=True, dropna=False)
+            .size()
+            .reset_index(name="n")
+        )
+        self.counts = self.counts[self.counts["n"] > 0]
+
+    @property
+    def empty(self) -> bool:
+        return self.counts.empty
+
+    def _slice(self, since=None):
+        counts = self.counts
+        if since is not None:
+            counts = counts[counts["День"] >= pd.Timestamp(since).normalize()]
+        return counts
+
+    def summary(self, by: str | None = None, since=None) -> pd.DataFrame:
+        """
+        Итоги по статусам: колонки total, waiting, called, solution, notified.
+        by — "Филиал" или "Категория" (строка на значение), иначе одна строка "Всего".
+        since — учитывать только жалобы начиная с этой даты.
+        """
+        counts = self._slice(since)
+        keys = counts[by].astype(object) if by else pd.Series("Всего", index=counts.index)
+        status = counts["Статус"].astype(object)
+
+        table = pd.DataFrame({"total": counts["n"].groupby(keys).sum()})
+        for field, name in STATUS_FIELDS.items():
+            table[field] = counts["n"].where(status == name, 0).groupby(keys).sum()
+        return table.fillna(0).astype(int).reindex(columns=SUMMARY_COLUMNS)
+
+    def last_activity(self, since=None):
+        """Дата последней жалобы (в окне since, если задано)"""
+        counts = self._slice(since)
+        return counts["День"].max() if not counts.empty else pd.NaT
+
+
+# ============================
+# ⚡ Живые счётчики
+# ============================
+class StatsCounters:
+    """
+    Счётчики филиал × категория × статус × день, которые обновляются при
+    каждом изменении жалобы (подписка на store) и пересобираются из базы
+    при запуске. Общая статистика отвечает без обхода строк.
+    Интерфейс (empty / summary / last_activity) совпадает с StatsCube.
+
+    version() — номер последнего изменения в базе: если его сдвинули другие
+    воркеры (изменения, о которых этот процесс не получил событий),
+    refresh() пересобирает счётчики.
+    """
+
+    def __init__(self, loader, version=None):
+        # loader() → DataFrame всех жалоб (для полной пересборки)
+        self.loader = loader
+        self.version = version
+        self._version = None
+        # своих изменений с последней сверки
+        self._own = 0
+        self.cells = Counter()
+        self.by_status = Counter()
+        self.by_branch = Counter()
+        self.total = 0
+        self.last_day = pd.NaT
+
+    def rebuild(self):
+        version = self.version() if self.version else None
+        counts = StatsCube(self.loader()).counts
+        self.cells = Counter()
+        self.by_status = Counter()
+        self.by_branch = Counter()
+        self.total = 0
+        self.last_day = pd.NaT
+        for branch, category, status, day, n in counts.itertuples(index=False, name=None):
+            self._add((str(branch), str(category), str(status), day), int(n))
+        self._version, self._own = version, 0
+        print(f"🧮 Счётчики статистики пересобраны: {self.total} жалоб")
+
+    @staticmethod
+    def _key(record: dict):
+        parsed = parse_date(record.get("Дата"))
+        day = pd.Timestamp(parsed).normalize() if parsed else pd.NaT
+        return (
+            str(record.get("Филиал", "")),
+            str(record.get("Категория", "")),
+            str(record.get("Статус", "")),
+            day,
+        )
+
+    def _add(self, key, n: int):
+        branch, _, status, day = key
+        self.cells[key] += n
+        self.by_status[status] += n
+        self.by_branch[branch] += n
+        self.total += n
+        if n > 0 and pd.notna(day) and (pd.isna(self.last_day) or day > self.last_day):
+            self.last_day = day
+
+    def on_change(self, before: dict | None, after: dict | None):
+        """Обработчик изменений store: переносит жалобу из старой ячейки в новую"""
+        if after is None:
+            # данные перезагружены целиком (импорт из Google Sheets)
+            self.rebuild()
+            return
+        if before is not None:
+            self._add(self._key(before), -1)
+        self._add(self._key(after), 1)
+        self._own += 1
+
+    def refresh(self):
+        """Сверка с базой: каждое изменение сдвигает version на 1"""
+        if self.version is None:
+            return
+        version = self.version()
+        if self._version is None or version != self._version + self._own:
+            self.rebuild()
+        else:
+            self._version, self._own = version, 0
+
+    @property
+    def empty(self) -> bool:
+        return self.total == 0
+
+    def summary(self, by: str | None = None, since=None) -> pd.DataFrame:
+        """Итоги по статусам, как StatsCube.summary (by — только "Филиал" или None, без since)"""
+        if since is not None:
+            raise ValueError("Счётчики ведутся за всё время — для окна используйте StatsCube")
+        if by is None:
+            row = {"total": self.total}
+            row.update({field: self.by_status[name] for field, name in STATUS_FIELDS.items()})
+            return pd.DataFrame([row], index=["Всего"], columns=SUMMARY_COLUMNS)
+        if by != "Филиал":
+            raise ValueError(f"Счётчики не ведутся по колонке {by}")
+        totals = pd.Series({b: n for b, n in self.by_branch.items() if n > 0}, dtype=int)
+        return pd.DataFrame({"total": totals}).reindex(columns=SUMMARY_COLUMNS)
+
+    def last_activity(self, since=None):
+        return self.last_day
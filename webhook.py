@@ -0,0 +1,128 @@
+import asyncio
+import signal
+import time
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from metrics import metrics
+
+
+# ============================
+# ⏳ Хендлеры в работе
+# ============================
+class InFlightTracker:
+    """
+    Outer-middleware на dp.update: считает апдейты, которые сейчас
+    обрабатываются, чтобы при остановке дождаться их завершения.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        metrics.set("updates_in_flight", self.active)
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe("update_seconds", time.monotonic() - started)
+            self.active -= 1
+            metrics.set("updates_in_flight", self.active)
+            if self.active == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def drain(bot, timeout: float = 30.0):
+    """Плавная остановка: дождаться хендлеров, затем отправить очередь в Google Sheets"""
+    started = time.monotonic()
+    # даём стартовать апдейтам, которые уже приняты, но ещё не начали обработку
+    await asyncio.sleep(0)
+    if not await bot.inflight.wait_idle(timeout):
+        print(f"⚠️ Не дождались {bot.inflight.active} хендлеров за {timeout:.0f} с")
+    replicator = getattr(bot, "replicator", None)
+    if replicator is not None:
+        await replicator.drain(max(1.0, timeout - (time.monotonic() - started)))
+
+
+def setup_graceful_shutdown(dp, bot):
+    """
+    Считает хендлеры в работе и при остановке диспетчера (polling или webhook)
+    дожидается их и очереди Google Sheets. Хук ставится первым, до закрытия
+    FSM-хранилища, чтобы дорабатывающие хендлеры могли записать состояние.
+    """
+    bot.inflight = InFlightTracker()
+    dp.update.outer_middleware(bot.inflight)
+
+    async def _on_shutdown():
+        await drain(bot, bot.config.get("SHUTDOWN_TIMEOUT", 30))
+
+    dp.shutdown.register(_on_shutdown)
+    dp.shutdown.handlers.insert(0, dp.shutdown.handlers.pop())
+
+
+# ============================
+# 🌐 Webhook-сервер
+# ============================
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render() + "\n")
+
+
+async def _health_view(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def run_webhook(dp, bot):
+    """
+    Принимает апдейты от Telegram через aiohttp вместо long polling.
+    Проверяет X-Telegram-Bot-Api-Secret-Token, отдаёт /metrics и /healthz.
+    По SIGTERM/SIGINT перестаёт принимать запросы, затем останавливает
+    диспетчер (см. setup_graceful_shutdown).
+    """
+    cfg = bot.config
+    secret = cfg["WEBHOOK_SECRET"]
+    path = cfg["WEBHOOK_PATH"]
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    app.router.add_get("/metrics", _metrics_view)
+    app.router.add_get("/healthz", _health_view)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, cfg["WEBAPP_HOST"], cfg["WEBAPP_PORT"])
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await site.start()
+        await bot.set_webhook(
+            cfg["WEBHOOK_URL"].rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        print(f"🌐 Webhook слушает {cfg['WEBAPP_HOST']}:{cfg['WEBAPP_PORT']}{path}")
+        await stop.wait()
+        print("🛑 Остановка: новые апдейты больше не принимаются")
+    finally:
+        # новые апдейты не принимаем, текущие — дорабатываем
+        await site.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await runner.cleanup()
+        await bot.session.close()